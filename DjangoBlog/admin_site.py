@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 
+from django.conf import settings
 from django.contrib.admin import AdminSite
-from DjangoBlog.utils import get_current_site
+from DjangoBlog.utils import get_current_site, publish_cache_stats, collect_cache_stats, summarize_cache_stats
+from DjangoBlog.latency import publish_latency_stats, collect_latency_stats, summarize_latency_stats
+from DjangoBlog.profiling import list_profiles, read_profile, make_profile_token
+from django.http import Http404, HttpResponse
+from django.template.response import TemplateResponse
 from django.contrib.sites.admin import SiteAdmin
 from django.contrib.admin.models import LogEntry
 from django.contrib.sites.models import Site
@@ -23,15 +28,63 @@ class DjangoBlogAdminSite(AdminSite):
     def has_permission(self, request):
         return request.user.is_superuser
 
-    # def get_urls(self):
-    #     urls = super().get_urls()
-    #     from django.urls import path
-    #     from blog.views import refresh_memcache
-    #
-    #     my_urls = [
-    #         path('refresh/', self.admin_view(refresh_memcache), name="refresh"),
-    #     ]
-    #     return urls + my_urls
+    def get_urls(self):
+        urls = super().get_urls()
+        from django.urls import path
+        from blog.views import refresh_memcache
+
+        my_urls = [
+            path('refresh/', self.admin_view(refresh_memcache), name="refresh"),
+            path('cache-stats/', self.admin_view(self.cache_stats_view), name="cache_stats"),
+            path('latency-stats/', self.admin_view(self.latency_stats_view), name="latency_stats"),
+            path('profiles/', self.admin_view(self.profiles_view), name="profiles"),
+            path('profiles/<str:name>', self.admin_view(self.profile_download_view), name="profile_download"),
+        ]
+        return my_urls + urls
+
+    def cache_stats_view(self, request):
+        """Hits, misses and compute time of the cached functions of every worker"""
+        publish_cache_stats(force=True)
+        processes = collect_cache_stats()
+        context = dict(
+            self.each_context(request),
+            title='Статистика кэша',
+            processes=sorted(processes),
+            cache_stats=summarize_cache_stats(processes),
+        )
+        return TemplateResponse(request, 'admin/cache_stats.html', context)
+
+    def latency_stats_view(self, request):
+        """Percentiles of the wall, database and template time per url name of every worker"""
+        publish_latency_stats(force=True)
+        processes = collect_latency_stats()
+        context = dict(
+            self.each_context(request),
+            title='Время ответа',
+            processes=sorted(processes),
+            latency_stats=summarize_latency_stats(processes),
+        )
+        return TemplateResponse(request, 'admin/latency_stats.html', context)
+
+    def profiles_view(self, request):
+        """Collapsed stack files written by ProfilingMiddleware and a token to profile a request"""
+        context = dict(
+            self.each_context(request),
+            title='Профили',
+            profiling_enabled=settings.PROFILING_ENABLED,
+            profiles=list_profiles(),
+            token=make_profile_token(),
+        )
+        return TemplateResponse(request, 'admin/profiles.html', context)
+
+    def profile_download_view(self, request, name):
+        try:
+            content = read_profile(name)
+        except FileNotFoundError:
+            raise Http404()
+        response = HttpResponse(content, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="{name}"'.format(name=name)
+        return response
 
 
 admin_site = DjangoBlogAdminSite(name='admin')
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import json
+import time
+import tracemalloc
+from django.db import connection
+from DjangoBlog.latency import QueryLog
+from DjangoBlog.utils import CACHE_STATS, flush_cache_namespace, local_cache
+
+BENCHMARK_PERCENTILES = (50, 95, 99)
+# vocabulary of the text generated for the benchmarks
+WORDS = ('cache', 'query', 'index', 'latency', 'server', 'python', 'django', 'template', 'worker', 'request',
+         'response', 'memory', 'thread', 'process', 'socket', 'nginx', 'uwsgi', 'memcached', 'database', 'table',
+         'row', 'column', 'page', 'list', 'article', 'comment', 'user', 'search', 'deploy', 'release', 'bug', 'fix',
+         'test', 'profile', 'metric', 'graph', 'the', 'a', 'of', 'to', 'and', 'in', 'is', 'for', 'with', 'on',
+         'that', 'by', 'it', 'as', 'fast', 'slow', 'small', 'large', 'new', 'old', 'simple', 'every', 'each')
+
+
+def percentiles(values):
+    """
+    :param values: durations in seconds
+    :return: {'p50': ms, 'p95': ms, 'p99': ms}, nearest rank
+    """
+    values = sorted(values)
+    result = {}
+    for p in BENCHMARK_PERCENTILES:
+        index = max(int(round(len(values) * p / 100.0)) - 1, 0) if values else None
+        result['p{0}'.format(p)] = round(values[index] * 1000, 3) if values else 0.0
+    return result
+
+
+def cache_stats_snapshot():
+    """:return: (hits, misses) of every cached function and the page cache of this process"""
+    hits = misses = 0
+    for stats in CACHE_STATS.values():
+        hits += stats.hits + stats.local_hits + stats.stale_hits
+        misses += stats.misses
+    return hits, misses
+
+
+def cache_hit_rate(before, after):
+    """:return: percent of the cache lookups between the two snapshots that hit, None without lookups"""
+    hits, misses = after[0] - before[0], after[1] - before[1]
+    return round(100.0 * hits / (hits + misses), 1) if hits + misses else None
+
+
+class Timer():
+    """Runs a function repeatedly and keeps the duration of every call"""
+
+    def __init__(self):
+        self.durations = []
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self, func, count):
+        self.started_at = time.perf_counter()
+        for _ in range(count):
+            start_time = time.perf_counter()
+            func()
+            self.durations.append(time.perf_counter() - start_time)
+        self.finished_at = time.perf_counter()
+
+    def per_second(self):
+        elapsed = self.finished_at - self.started_at
+        return round(len(self.durations) / elapsed, 1) if elapsed else 0.0
+
+
+def empty_caches():
+    """Make every cached value of the blog a miss, without clearing the rest of the shared cache"""
+    flush_cache_namespace()
+    local_cache.clear()
+
+
+def measure_op(func, count, before=None):
+    """
+    Time a function alone, then trace its allocations in a second pass as tracemalloc slows them down
+    :param before: called before every call, not measured, e.g. empty_caches
+    :return: {'ns_per_op', 'queries', 'peak_bytes', 'retained_bytes'} per call
+    """
+    elapsed = 0
+    queries = QueryLog()
+    for _ in range(count):
+        if before:
+            before()
+        with connection.execute_wrapper(queries):
+            start_time = time.perf_counter_ns()
+            func()
+            elapsed += time.perf_counter_ns() - start_time
+    peak = retained = 0
+    for _ in range(count):
+        if before:
+            before()
+        # tracing starts from zero for every call, reset_peak isn't there before Python 3.9
+        tracemalloc.start()
+        try:
+            func()
+            after, op_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak += op_peak
+        retained += after
+    return {
+        'ns_per_op': elapsed // count,
+        'queries': round(queries.count / float(count), 2),
+        'peak_bytes': peak // count,
+        'retained_bytes': retained // count,
+    }
+
+
+# (metric, True if higher is better)
+BASELINE_METRICS = (('p95', False), ('queries', False), ('rps', True), ('ns_per_op', False))
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    :param results: {name: {metric: value}}
+    :param baseline: results of an earlier run
+    :param threshold: change flagged, 0.2 is 20% worse
+    :return: list of the regressions as text
+    """
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in BASELINE_METRICS:
+            value, base_value = metrics.get(metric), base.get(metric)
+            if value is None or not base_value:
+                continue
+            change = (value - base_value) / float(base_value)
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append('{name} {metric}: {base} -> {value} ({change:+.0%})'.format(
+                    name=name, metric=metric, base=base_value, value=value, change=change))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def sentence(rng, low=6, high=16):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng):
+    return ' '.join(sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def markdown(rng, blocks=None):
+    """
+    Headings, paragraphs, lists, code blocks, links and quotes, about the size of a blog post
+    :param blocks: number of blocks, 4 to 12 by default
+    """
+    text = []
+    for _ in range(blocks or rng.randint(4, 12)):
+        kind = rng.random()
+        if kind < 0.15:
+            text.append('## ' + sentence(rng, 2, 5)[:-1])
+        elif kind < 0.3:
+            text.append('\n'.join('- ' + sentence(rng, 3, 8) for _ in range(rng.randint(2, 6))))
+        elif kind < 0.4:
+            lines = ['{0} = {1}({2})'.format(rng.choice(WORDS), rng.choice(WORDS), rng.randrange(100))
+                     for _ in range(rng.randint(2, 10))]
+            text.append('```python\n' + '\n'.join(lines) + '\n```')
+        elif kind < 0.45:
+            text.append('> ' + sentence(rng))
+        else:
+            block = paragraph(rng)
+            if rng.random() < 0.3:
+                block += ' [{0}](https://example.com/{0})'.format(rng.choice(WORDS))
+            text.append(block)
+    return '\n\n'.join(text)
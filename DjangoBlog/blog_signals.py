@@ -7,13 +7,14 @@ from django.conf import settings
 from django.contrib.admin.models import LogEntry
 from DjangoBlog.utils import get_current_site
 from django.core.mail import EmailMultiAlternatives
-from django.db.models.signals import post_save
-from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.contrib.sessions.models import Session
 
-from DjangoBlog.utils import cache, send_email, expire_view_cache, delete_sidebar_cache, delete_view_cache
+from DjangoBlog.utils import send_email, expire_view_cache, invalidate_cache_tags, get_instance_cache_tags, cache_tag
 from DjangoBlog.spider_notify import SpiderNotify
 from oauth.models import OAuthUser
 from blog.models import Article, Category, Tag, Links, SideBar, BlogSettings
+from blog.visitors import forget_visitors
 from comments.models import Comment
 from comments.utils import send_comment_email
 import _thread
@@ -72,20 +73,23 @@ def oauth_user_login_signal_handler(sender, **kwargs):
         oauthuser.picture = save_user_avatar(oauthuser.picture)
         oauthuser.save()
 
-    delete_sidebar_cache(oauthuser.author.username)
 
-    cache.clear()
+def invalidate_instance_cache(instance, whole_model=False):
+    """Evict only the cached values built from the instance"""
+    tags = get_instance_cache_tags(instance, whole_model)
+    if isinstance(instance, Comment):
+        # comment lists and comment counts are cached per article
+        tags.append(cache_tag(Article, instance.article_id))
+    invalidate_cache_tags(*tags)
 
 
 @receiver(post_save)
 def model_post_save_callback(sender, instance, created, raw, using, update_fields, **kwargs):
-    clearcache = False
-    if isinstance(instance, LogEntry):
+    if isinstance(instance, (LogEntry, Session)):
         return
-    if 'get_full_url' in dir(instance):
-        is_update_views = update_fields == {'views'}
-        if not is_update_views:
-            clearcache = True
+    # neither the view counter nor the last login time is part of any cached value
+    if update_fields not in ({'views'}, {'last_login'}):
+        invalidate_instance_cache(instance, whole_model=created)
     if isinstance(instance, Comment):
 
         path = instance.article.get_absolute_url()
@@ -94,23 +98,22 @@ def model_post_save_callback(sender, instance, created, raw, using, update_field
             site = site[0:site.find(':')]
 
         expire_view_cache(path, servername=site, serverport=80, key_prefix='blogdetail')
-        if cache.get('seo_processor'):
-            cache.delete('seo_processor')
-        comment_cache_key = 'article_comments_{id}'.format(id=instance.article.id)
-        cache.delete(comment_cache_key)
-        delete_sidebar_cache(instance.author.username)
-        delete_view_cache('article_comments', [str(instance.article.pk)])
 
         _thread.start_new(send_comment_email, (instance,))
 
-    if clearcache:
-        cache.clear()
+
+@receiver(post_delete)
+def model_post_delete_callback(sender, instance, using, **kwargs):
+    if isinstance(instance, (LogEntry, Session)):
+        return
+    if isinstance(instance, Article):
+        forget_visitors(instance.id)
+    invalidate_instance_cache(instance, whole_model=True)
 
 
-@receiver(user_logged_in)
-@receiver(user_logged_out)
-def user_auth_callback(sender, request, user, **kwargs):
-    if user and user.username:
-        logger.info(user)
-        delete_sidebar_cache(user.username)
-        cache.clear()
+@receiver(m2m_changed)
+def model_m2m_changed_callback(sender, instance, action, reverse, model, pk_set, using, **kwargs):
+    if not action.startswith('post_'):
+        return
+    # the rows of both sides move in and out of lists
+    invalidate_cache_tags(*get_instance_cache_tags(instance, whole_model=True), model)
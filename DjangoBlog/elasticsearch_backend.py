@@ -32,8 +32,7 @@ class ElasticSearchBackend(BaseSearchBackend):
 
     def _create(self, models):
         self.manager.create_index()
-        docs = self._get_models(models)
-        self.manager.rebuild(docs)
+        self.manager.rebuild(models or None)
 
     def _delete(self, models):
         for m in models:
@@ -41,14 +40,10 @@ class ElasticSearchBackend(BaseSearchBackend):
         return True
 
     def _rebuild(self, models):
-        models = models if models else Article.objects.all()
-        docs = self.manager.convert_to_doc(models)
-        self.manager.update_docs(docs)
+        self.manager.bulk_index(models or None)
 
     def update(self, index, iterable, commit=True):
-
-        models = self._get_models(iterable)
-        self.manager.update_docs(models)
+        self.manager.bulk_index(iterable)
 
     def remove(self, obj_or_string):
         models = self._get_models([obj_or_string])
@@ -4,11 +4,15 @@ from django.contrib.syndication.views import Feed
 from blog.models import Article
 from django.conf import settings
 from django.utils.feedgenerator import Rss201rev2Feed
-from DjangoBlog.utils import CommonMarkdown
 from django.contrib.auth import get_user_model
+from django.db.models import Max
 from datetime import datetime
 
 
+def get_feed_last_modified(request, *args, **kwargs):
+    return Article.objects.aggregate(last_mod_time=Max('last_mod_time'))['last_mod_time']
+
+
 class DjangoBlogFeed(Feed):
     feed_type = Rss201rev2Feed
 
@@ -29,7 +33,7 @@ class DjangoBlogFeed(Feed):
         return item.title
 
     def item_description(self, item):
-        return CommonMarkdown.get_markdown(item.body)
+        return item.get_body_html()
 
     def feed_copyright(self):
         now = datetime.now()
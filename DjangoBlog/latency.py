@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import logging
+import time
+from collections import Counter
+from django.conf import settings
+from DjangoBlog.utils import cache, get_process_name
+
+logger = logging.getLogger(__name__)
+
+# 16 buckets per power of two, a recorded value is at most 1/16 off
+HISTOGRAM_SUB_BUCKETS = 16
+# microseconds, longer requests are counted in the last bucket
+HISTOGRAM_MAX_VALUE = 1 << 32
+LATENCY_KINDS = ('wall', 'db', 'template')
+LATENCY_PERCENTILES = (50, 95, 99)
+LATENCY_STATS = {}
+LATENCY_STATS_KEY = 'latency_stats_{process}'
+LATENCY_STATS_PROCESSES_KEY = 'latency_stats_processes'
+# Seconds between two snapshots of the histograms of a process written to the shared cache
+LATENCY_STATS_PUBLISH_INTERVAL = 30
+_latency_stats_published_at = 0
+
+
+class Histogram():
+    """
+    Log-linear histogram of durations in microseconds, HDR style: the memory is fixed
+    and the percentiles are within 1/16 of the recorded values
+    """
+
+    def __init__(self, counts=None):
+        self.counts = [0] * (self.index(HISTOGRAM_MAX_VALUE - 1) + 1)
+        if counts:
+            self.merge(counts)
+
+    @staticmethod
+    def index(value):
+        if value < 2 * HISTOGRAM_SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - HISTOGRAM_SUB_BUCKETS.bit_length()
+        return (shift + 1) * HISTOGRAM_SUB_BUCKETS + (value >> shift) - HISTOGRAM_SUB_BUCKETS
+
+    @staticmethod
+    def value(index):
+        """:return: middle of the values counted in the bucket"""
+        if index < 2 * HISTOGRAM_SUB_BUCKETS:
+            return index
+        shift = index // HISTOGRAM_SUB_BUCKETS - 1
+        lowest = (index % HISTOGRAM_SUB_BUCKETS + HISTOGRAM_SUB_BUCKETS) << shift
+        return lowest + (1 << shift) // 2
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1000000), 0), HISTOGRAM_MAX_VALUE - 1)
+        self.counts[self.index(value)] += 1
+
+    def merge(self, counts):
+        """
+        :param counts: result of as_dict of another histogram
+        """
+        for index, count in counts.items():
+            self.counts[int(index)] += count
+
+    def total(self):
+        return sum(self.counts)
+
+    def percentile(self, percent):
+        """:return: milliseconds"""
+        rank = self.total() * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.value(index) / 1000.0
+        return 0.0
+
+    def as_dict(self):
+        """Only the buckets counting something, it's what is published"""
+        return {index: count for index, count in enumerate(self.counts) if count}
+
+
+def record_latency(name, **durations):
+    """
+    :param name: url name of the view, e.g. blog:index
+    :param durations: seconds by kind of LATENCY_KINDS
+    """
+    histograms = LATENCY_STATS.get(name)
+    if histograms is None:
+        histograms = LATENCY_STATS.setdefault(name, {kind: Histogram() for kind in LATENCY_KINDS})
+    for kind, seconds in durations.items():
+        histograms[kind].record(seconds)
+    publish_latency_stats()
+
+
+def publish_latency_stats(force=False):
+    """Write the histograms of this process to the shared cache, at most once per LATENCY_STATS_PUBLISH_INTERVAL"""
+    global _latency_stats_published_at
+    now = time.time()
+    if not force and now - _latency_stats_published_at < LATENCY_STATS_PUBLISH_INTERVAL:
+        return
+    _latency_stats_published_at = now
+    process = get_process_name()
+    cache.set(LATENCY_STATS_KEY.format(process=process),
+              {name: {kind: h.as_dict() for kind, h in histograms.items()}
+               for name, histograms in list(LATENCY_STATS.items())}, 60 * 60 * 24)
+    processes = cache.get(LATENCY_STATS_PROCESSES_KEY) or {}
+    processes = {p: seen for p, seen in processes.items() if now - seen < 60 * 60 * 24}
+    processes[process] = now
+    cache.set(LATENCY_STATS_PROCESSES_KEY, processes, 60 * 60 * 24)
+
+
+def collect_latency_stats():
+    """
+    Histograms published by every process, counted since the process started
+    :return: {process: {url name: {kind: counts}}}
+    """
+    processes = cache.get(LATENCY_STATS_PROCESSES_KEY) or {}
+    keys = {LATENCY_STATS_KEY.format(process=p): p for p in processes}
+    values = cache.get_many(list(keys))
+    return {keys[k]: v for k, v in values.items()}
+
+
+def summarize_latency_stats(processes):
+    """
+    Merge the histograms of every process per url name
+    :param processes: result of collect_latency_stats
+    :return: list of dicts sorted by url name, with the count and p50, p95, p99 in milliseconds of every kind
+    """
+    merged = {}
+    for names in processes.values():
+        for name, kinds in names.items():
+            histograms = merged.setdefault(name, {kind: Histogram() for kind in LATENCY_KINDS})
+            for kind, counts in kinds.items():
+                histograms[kind].merge(counts)
+    summary = []
+    for name, histograms in sorted(merged.items()):
+        row = {'name': name, 'count': histograms['wall'].total()}
+        for kind, histogram in histograms.items():
+            row[kind] = [round(histogram.percentile(p), 1) for p in LATENCY_PERCENTILES]
+        summary.append(row)
+    return summary
+
+
+class QueryLog():
+    """Database execute wrapper counting the queries of a request, their time and the repeated ones"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start_time
+            self.count += 1
+            self.statements[sql] += 1
+
+    def repeated(self, limit=None):
+        """
+        Statements run more than limit times, with other parameters it's usually a query per item of a list
+        :return: [(sql, count)], the most repeated first
+        """
+        limit = settings.QUERY_REPEAT_LIMIT if limit is None else limit
+        return [(sql, count) for sql, count in self.statements.most_common() if count > limit]
+
+
+def get_query_budget(name):
+    return settings.QUERY_BUDGETS.get(name, settings.QUERY_BUDGET)
+
+
+def check_query_budget(name, queries):
+    """
+    :param name: url name of the view
+    :param queries: QueryLog of the request
+    :return: list of the problems, empty within the budget
+    """
+    problems = []
+    budget = get_query_budget(name)
+    if queries.count > budget:
+        problems.append('{count} queries, the budget is {budget}'.format(count=queries.count, budget=budget))
+    for sql, count in queries.repeated():
+        problems.append('{count} times: {sql}'.format(count=count, sql=sql[:200]))
+    if problems:
+        logger.warning('%s ran %d queries in %.1f ms: %s', name, queries.count, queries.time * 1000,
+                       '; '.join(problems))
+    return problems
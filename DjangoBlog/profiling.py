@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import datetime
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from django.conf import settings
+from django.core import signing
+
+PROFILE_SALT = 'DjangoBlog.profiling'
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+\.folded$')
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of a thread every interval seconds until stopped, as collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+def collapse_stack(frame):
+    """
+    :return: frames from the outermost to frame, separated by ;
+    only frame has its line, the samples of one call path are counted as one stack
+    """
+    frames = []
+    leaf = frame
+    while frame is not None:
+        code = frame.f_code
+        path = '/'.join(code.co_filename.split(os.sep)[-2:])
+        if frame is leaf:
+            path = '{path}:{line}'.format(path=path, line=frame.f_lineno)
+        frames.append('{function} ({file})'.format(function=code.co_name, file=path))
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+def make_profile_token():
+    """:return: value of the X-Profile header or the profile parameter that profiles a request"""
+    return signing.dumps('profile', salt=PROFILE_SALT)
+
+
+def is_valid_profile_token(token):
+    try:
+        return signing.loads(token, salt=PROFILE_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def save_profile(name, stacks):
+    """
+    Append the stacks of a request to the collapsed stack file of the view for today,
+    one write so the processes don't mix their lines
+    :param name: url name of the view
+    """
+    if not stacks:
+        return
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    filename = '{name}.{date}.folded'.format(name=re.sub(r'[^\w.-]', '-', name),
+                                            date=datetime.date.today().strftime('%Y%m%d'))
+    lines = ''.join('{stack} {count}\n'.format(stack=stack, count=count) for stack, count in stacks.items())
+    with open(os.path.join(settings.PROFILING_DIR, filename), 'a') as f:
+        f.write(lines)
+
+
+def list_profiles(limit=100):
+    """:return: [(file name, size, modification time)] the most recent first"""
+    if not os.path.isdir(settings.PROFILING_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(settings.PROFILING_DIR):
+        if PROFILE_NAME_RE.match(name):
+            stat = os.stat(os.path.join(settings.PROFILING_DIR, name))
+            profiles.append((name, stat.st_size, datetime.datetime.fromtimestamp(stat.st_mtime)))
+    return sorted(profiles, key=lambda p: p[2], reverse=True)[:limit]
+
+
+def read_profile(name):
+    """
+    :return: the stacks of a file summed, the collapsed format flamegraph.pl and speedscope read
+    :raise FileNotFoundError: for a name that isn't a profile
+    """
+    if not PROFILE_NAME_RE.match(name):
+        raise FileNotFoundError(name)
+    stacks = Counter()
+    with open(os.path.join(settings.PROFILING_DIR, name)) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return ''.join('{stack} {count}\n'.format(stack=stack, count=count) for stack, count in sorted(stacks.items()))
@@ -62,6 +62,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.middleware.LatencyMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -73,7 +74,9 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.http.ConditionalGetMiddleware',
+    'blog.middleware.ProfilingMiddleware',
     'blog.middleware.OnlineMiddleware',
+    'blog.middleware.PageCacheMiddleware',
 
 ]
 
@@ -186,6 +189,40 @@ BOOTSTRAP_COLOR_TYPES = [
 
 # paginate
 PAGINATE_BY = 10
+# Page article lists by cursors seeking on (article_order, pub_time, id) instead of OFFSET and COUNT
+CURSOR_PAGINATION = False
+# Query parameters the cached pages depend on, PageCacheMiddleware doesn't cache pages requested with others
+PAGE_CACHE_QUERY_PARAMS = ('page', 'cursor')
+# Request times indexed in Elasticsearch when ELASTICSEARCH_DSL is set: the share of requests sampled,
+# the queue of documents waiting for the bulk request, new ones are dropped while it's full
+ELAPSED_TIME_SAMPLE_RATE = 1.0
+ELAPSED_TIME_QUEUE_SIZE = 1000
+ELAPSED_TIME_BATCH_SIZE = 200
+# seconds a batch waits to fill up
+ELAPSED_TIME_FLUSH_INTERVAL = 5
+# Articles per bulk request when they are indexed, and the requests sent at once
+ELASTICSEARCH_INDEX_CHUNK_SIZE = 500
+ELASTICSEARCH_INDEX_THREADS = 2
+# Visitors of an article expected in one window and the share of them taken for visitors already seen,
+# the Bloom filters counting a view once per visitor are sized from them
+VISITORS_PER_WINDOW = 2000
+VISITORS_FALSE_POSITIVE_RATE = 0.01
+# Queries a view may run in one request, LatencyMiddleware logs the views over their budget
+# and the statements run more than QUERY_REPEAT_LIMIT times in one request, a query per item of a list
+QUERY_BUDGET = 30
+QUERY_BUDGETS = {
+    'blog:index': 20,
+    'blog:index_page': 20,
+    'blog:detailbyid': 25,
+}
+QUERY_REPEAT_LIMIT = 3
+# Sampling profiler of ProfilingMiddleware: the share of requests profiled, the seconds between two samples
+# of the stack, how long a profile token of the admin stays valid and where the collapsed stacks are written
+PROFILING_ENABLED = os.getenv('DJANGO_PROFILING', False)
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_INTERVAL = 0.005
+PROFILING_TOKEN_MAX_AGE = 60 * 60 * 24
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
 # http cache timeout
 CACHE_CONTROL_MAX_AGE = 2592000
 
@@ -4,9 +4,15 @@ from django.contrib.sitemaps import Sitemap
 from blog.models import Article, Category, Tag
 from accounts.models import BlogUser
 from django.contrib.sitemaps import GenericSitemap
+from django.db.models import Max
 from django.urls import reverse
 
 
+def get_sitemap_last_modified(request, *args, **kwargs):
+    times = [m.objects.aggregate(last_mod_time=Max('last_mod_time'))['last_mod_time'] for m in (Article, Category, Tag)]
+    return max(filter(None, times), default=None)
+
+
 class StaticViewSitemap(Sitemap):
     priority = 0.5
     changefreq = 'daily'
@@ -56,7 +62,7 @@ class UserSiteMap(Sitemap):
     priority = "0.3"
 
     def items(self):
-        return list(set(map(lambda x: x.author, Article.objects.all())))
+        return BlogUser.objects.filter(pk__in=Article.objects.values('author_id')).order_by('id')
 
     def lastmod(self, obj):
         return obj.date_joined
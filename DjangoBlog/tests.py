@@ -6,6 +6,7 @@ from django.contrib.auth import get_user_model
 from DjangoBlog.utils import get_current_site
 from django.urls import reverse
 import datetime
+from io import StringIO
 from DjangoBlog.utils import *
 
 
@@ -41,3 +42,152 @@ class DjangoBlogTest(TestCase):
         self.assertTrue(s.find('nofollow') > 0)
         s = render.link('http://www.baidu.com', 'test', 'test')
         self.assertTrue(s.find('nofollow') > 0)
+
+    def test_cache_tags(self):
+        set_tagged_cache('test_cache_tags', 'value', [cache_tag(Article, 1), cache_tag(Tag)])
+        self.assertEqual(get_tagged_cache('test_cache_tags', ['blog.article:1', 'blog.tag']), (True, 'value'))
+        invalidate_cache_tags('blog.category')
+        self.assertEqual(get_tagged_cache('test_cache_tags', ['blog.article:1', 'blog.tag']), (True, 'value'))
+        invalidate_cache_tags(Tag)
+        self.assertEqual(get_tagged_cache('test_cache_tags', ['blog.article:1', 'blog.tag']), (False, None))
+
+        version = get_cache_version(Category)
+        category = Category()
+        category.name = 'cache_tags'
+        category.save()
+        self.assertNotEqual(version, get_cache_version(Category))
+
+        # only the changes the lists show evict the whole model
+        user = get_user_model().objects.create(username='cache_tags', email='cache_tags@example.com')
+        Article.objects.create(title='cache_tags', body='cache_tags', author=user, category=category)
+        article = Article.objects.get(title='cache_tags')
+        model_version, row_version = get_cache_version(Article), get_cache_version(article)
+        article.body = 'edited'
+        article.save()
+        self.assertEqual(model_version, get_cache_version(Article))
+        self.assertNotEqual(row_version, get_cache_version(article))
+        article.status = 'd'
+        article.save()
+        self.assertNotEqual(model_version, get_cache_version(Article))
+
+    def test_cache_namespace(self):
+        set_tagged_cache('test_cache_namespace', 'lists', [], namespace='lists')
+        set_tagged_cache('test_cache_namespace', 'sidebar', [], namespace='sidebar')
+        flush_cache_namespace('lists')
+        self.assertEqual(get_tagged_cache('test_cache_namespace', [], 'lists'), (False, None))
+        self.assertEqual(get_tagged_cache('test_cache_namespace', [], 'sidebar'), (True, 'sidebar'))
+        self.assertRaises(ValueError, flush_cache_namespace, 'unknown')
+
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        set_tagged_cache('test_cache_namespace', 'sidebar', [], namespace='sidebar')
+        call_command('clear_cache', 'lists', stdout=StringIO())
+        self.assertEqual(get_tagged_cache('test_cache_namespace', [], 'sidebar'), (True, 'sidebar'))
+        call_command('clear_cache', stdout=StringIO())
+        self.assertEqual(get_tagged_cache('test_cache_namespace', [], 'sidebar'), (False, None))
+        self.assertRaises(CommandError, call_command, 'clear_cache', 'unknown')
+
+    def test_cache_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(get_or_set_tagged_cache('test_single_flight', compute, ['blog.tag']), 1)
+        self.assertEqual(get_or_set_tagged_cache('test_single_flight', compute, ['blog.tag']), 1)
+        invalidate_cache_tags(Tag)
+        # another caller is rebuilding the value: the stale one is served
+        cache.add(namespaced_key(DEFAULT_CACHE_NAMESPACE, 'test_single_flight') + '_lock', 1)
+        self.assertEqual(get_or_set_tagged_cache('test_single_flight', compute, ['blog.tag']), 1)
+        cache.delete(namespaced_key(DEFAULT_CACHE_NAMESPACE, 'test_single_flight') + '_lock')
+        self.assertEqual(get_or_set_tagged_cache('test_single_flight', compute, ['blog.tag']), 2)
+
+    def test_cache_key(self):
+        article = Article(id=1)
+        key = make_cache_key(Article.next_article, (article,), {})
+        self.assertTrue(key.startswith('blog.models.Article.next_article_'))
+        self.assertEqual(key, make_cache_key(Article.next_article, (Article(id=1),), {}))
+
+        stats = Article.next_article.cache_stats
+        misses = stats.misses
+        article.next_article()
+        article.next_article()
+        self.assertEqual(stats.misses, misses + 1)
+        publish_cache_stats(force=True)
+        totals = summarize_cache_stats(collect_cache_stats())
+        self.assertIn('blog.models.Article.next_article', [t['name'] for t in totals])
+
+    def test_local_cache(self):
+        stats = get_blog_setting.cache_stats
+        setting = get_blog_setting()
+        local_hits = stats.local_hits
+        self.assertIs(get_blog_setting(), setting)
+        self.assertEqual(stats.local_hits, local_hits + 1)
+
+        setting.sitename = 'local cache'
+        setting.save()
+        self.assertEqual(get_blog_setting().sitename, 'local cache')
+
+        lru = LocalCache(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_latency_histogram(self):
+        from DjangoBlog.latency import Histogram, summarize_latency_stats
+        histogram = Histogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000.0)
+        self.assertEqual(histogram.total(), 1000)
+        self.assertAlmostEqual(histogram.percentile(50), 500, delta=500 / 16)
+        self.assertAlmostEqual(histogram.percentile(99), 990, delta=990 / 16)
+        histogram.record(60 * 60 * 24)
+        self.assertEqual(len(histogram.counts), len(Histogram().counts))
+
+        counts = {'wall': histogram.as_dict(), 'db': {}, 'template': {}}
+        summary = summarize_latency_stats({'a:1': {'blog:index': counts}, 'a:2': {'blog:index': counts}})
+        self.assertEqual(summary[0]['name'], 'blog:index')
+        self.assertEqual(summary[0]['count'], 2002)
+        self.assertEqual(summary[0]['db'], [0.0, 0.0, 0.0])
+
+    def test_profiling(self):
+        import tempfile
+        import threading
+        import time
+        from django.test import override_settings
+        from DjangoBlog.profiling import StackSampler, make_profile_token, list_profiles
+
+        def busy():
+            end = time.time() + 0.05
+            while time.time() < end:
+                pass
+
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy()
+        stacks = sampler.stop()
+        self.assertTrue(any('busy (DjangoBlog/tests.py' in stack.split(';')[-1] for stack in stacks))
+        # the callers have no line, a loop in busy doesn't split their samples
+        self.assertTrue(any(stack.split(';')[-2] == 'test_profiling (DjangoBlog/tests.py)' for stack in stacks))
+
+        with tempfile.TemporaryDirectory() as profiles, \
+                override_settings(PROFILING_ENABLED=True, PROFILING_INTERVAL=0.0001, PROFILING_DIR=profiles):
+            client = Client()
+            client.get('/', {'profile': 'forged'})
+            self.assertEqual(list_profiles(), [])
+            client.get('/', {'profile': make_profile_token()})
+            name = list_profiles()[0][0]
+            self.assertTrue(name.startswith('blog-index.'))
+
+            user = get_user_model().objects.create_superuser(email="profiles@gmail.com", username="profiles",
+                                                             password="profiles")
+            client.force_login(user)
+            response = client.get(reverse('admin:profiles'))
+            self.assertContains(response, name)
+            response = client.get(reverse('admin:profile_download', args=[name]))
+            self.assertIn(b'get_response', response.content)
+            response = client.get(reverse('admin:profile_download', args=['..settings.py']))
+            self.assertEqual(response.status_code, 404)
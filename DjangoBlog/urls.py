@@ -17,11 +17,13 @@ from django.conf.urls import url, include
 from django.contrib import admin
 from django.contrib.sitemaps.views import sitemap
 from DjangoBlog.sitemap import StaticViewSitemap, ArticleSiteMap, CategorySiteMap, TagSiteMap, UserSiteMap
-from DjangoBlog.feeds import DjangoBlogFeed
+from DjangoBlog.sitemap import get_sitemap_last_modified
+from DjangoBlog.feeds import DjangoBlogFeed, get_feed_last_modified
 from django.views.decorators.cache import cache_page
 from django.conf import settings
 from django.conf.urls.static import static
 from DjangoBlog.admin_site import admin_site
+from DjangoBlog.utils import cache_response, conditional_page
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 from django.views.generic import TemplateView
@@ -39,6 +41,12 @@ sitemaps = {
 handler404 = 'blog.views.page_not_found_view'
 handler500 = 'blog.views.server_error_view'
 handle403 = 'blog.views.permission_denied_view'
+sitemap_dependencies = ('blog.article', 'blog.category', 'blog.tag', 'accounts.bloguser')
+sitemap_view = conditional_page(get_sitemap_last_modified, sitemap_dependencies)(
+    cache_response(60 * 60 * 10, depends_on=sitemap_dependencies)(sitemap))
+feed_dependencies = ('blog.article', 'accounts.bloguser')
+feed_view = conditional_page(get_feed_last_modified, feed_dependencies)(
+    cache_response(60 * 60 * 10, depends_on=feed_dependencies)(DjangoBlogFeed()))
 favicon_view = RedirectView.as_view(url='/static/favicon.ico', permanent=True)
 urlpatterns = [
     url(r'^admin/', admin_site.urls),
@@ -47,10 +55,10 @@ urlpatterns = [
     url(r'', include('comments.urls', namespace='comment')),
     url(r'', include('accounts.urls', namespace='account')),
     url(r'', include('oauth.urls', namespace='oauth')),
-    url(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps},
+    url(r'^sitemap\.xml$', sitemap_view, {'sitemaps': sitemaps},
         name='django.contrib.sitemaps.views.sitemap'),
-    url(r'^feed/$', DjangoBlogFeed()),
-    url(r'^rss/$', DjangoBlogFeed()),
+    url(r'^feed/$', feed_view),
+    url(r'^rss/$', feed_view),
     url(r'^favicon\.ico$', favicon_view),
     url(r'^search', include('haystack.urls'), name='search'),
     url(r'', include('servermanager.urls', namespace='servermanager')),
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
 from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.contrib.sites.models import Site
+from django.db import models
+from django.http import HttpResponse
+from django.views.decorators.http import condition
 from hashlib import md5
 import markdown2
 from django.conf import settings
@@ -9,6 +13,13 @@ import logging
 import requests
 import uuid
 import os
+import time
+import math
+import random
+import socket
+import functools
+import threading
+from collections import OrderedDict
 logger = logging.getLogger(__name__)
 
 
@@ -23,40 +34,602 @@ def get_md5(str):
     return m.hexdigest()
 
 
-def cache_decorator(expiration=3 * 60):
+CACHE_GENERATION_KEY = 'cache_generation_{tag}'
+
+# Every cached value belongs to one namespace, flushing it bumps a single generation counter
+# and leaves the other namespaces and foreign keys (e.g. robot sessions) untouched
+CACHE_NAMESPACES = (
+    'default',
+    'lists',
+    'sidebar',
+    'article',
+    'comments',
+    'settings',
+    'site',
+    'feeds',
+    'oauth',
+    'avatar',
+    'markdown',
+    'pages',
+)
+DEFAULT_CACHE_NAMESPACE = 'default'
+# Seconds a value is kept after it expired, to be served while it is recomputed
+CACHE_STALE_TIMEOUT = 60 * 5
+# Seconds the recomputation lock is held at most
+CACHE_LOCK_TIMEOUT = 10
+# Seconds a caller without a stale value waits for another one to recompute it
+CACHE_LOCK_WAIT = 0.5
+# >1 favours earlier recomputation, <1 later
+XFETCH_BETA = 1.0
+# Entries of the in-process cache kept in front of the shared one
+CACHE_LOCAL_MAX_SIZE = 512
+# Seconds an entry lives in the in-process cache
+CACHE_LOCAL_TIMEOUT = 60
+# Seconds a generation read from the shared cache is trusted by this process,
+# i.e. how long another worker's invalidation may go unnoticed by the in-process cache
+CACHE_LOCAL_GENERATION_TIMEOUT = 5
+
+
+class LocalCache():
+    """Bounded in-process LRU cache with a time to live"""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.time() - stored_at > self.timeout:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalCache(CACHE_LOCAL_MAX_SIZE, CACHE_LOCAL_TIMEOUT)
+_local_generations = LocalCache(CACHE_LOCAL_MAX_SIZE * 4, CACHE_LOCAL_GENERATION_TIMEOUT)
+# Dependency tags read by the current thread while a cacheable page is rendered
+_collected_tags = threading.local()
+
+
+def cache_tag(obj, pk=None):
+    """
+    Dependency tag of a cached value
+    :param obj: model instance, model class or 'app_label.model_name' string
+    :param pk: primary key of a single row of the model
+    :return: 'blog.article' for a model, 'blog.article:1' for a single row
+    """
+    if isinstance(obj, str):
+        label = obj.lower()
+    else:
+        label = obj._meta.label_lower
+        if not isinstance(obj, type):
+            pk = obj.pk
+    if pk is None:
+        return label
+    return '{label}:{pk}'.format(label=label, pk=pk)
+
+
+def get_instance_cache_tags(instance, whole_model=False):
+    """
+    Tags which are invalidated when the instance changes: its own row, and its whole model unless
+    the change can't alter the lists of the model, see blog.models.CacheListedModel
+    :param whole_model: invalidate the model tag anyway, for inserted and deleted rows
+    """
+    tags = [cache_tag(instance)]
+    list_changed = getattr(instance, 'cache_list_changed', None)
+    # called anyway, it remembers the values for the next save
+    list_changed = list_changed() if list_changed else True
+    if whole_model or list_changed:
+        tags.append(cache_tag(type(instance)))
+    return tags
+
+
+def _new_generation():
+    return int(time.time() * 1000)
+
+
+def get_tag_generations(tags, values=None):
+    """
+    Current generation of each dependency tag, a missing one is started anew
+    :param tags: dependency tags
+    :param values: result of an already done cache.get_many, if any
+    :return: {tag: generation}
+    """
+    keys = {CACHE_GENERATION_KEY.format(tag=tag): tag for tag in tags}
+    if values is None:
+        values = cache.get_many(list(keys))
+    generations = {}
+    for key, tag in keys.items():
+        generation = values.get(key)
+        if generation is None:
+            generation = _new_generation()
+            if not cache.add(key, generation, None):
+                generation = cache.get(key, generation)
+        generations[tag] = generation
+    return generations
+
+
+def start_collecting_cache_tags():
+    _collected_tags.tags = set()
+
+
+def stop_collecting_cache_tags():
+    """:return: tags read through the tagged cache or added by add_cache_tags since start_collecting_cache_tags"""
+    tags = getattr(_collected_tags, 'tags', None)
+    _collected_tags.tags = None
+    return tags or set()
+
+
+def add_cache_tags(*objs):
+    """
+    Mark the page being rendered as depending on the objs, for data which is not read through the tagged cache
+    :param objs: model instances, model classes or tags
+    """
+    tags = getattr(_collected_tags, 'tags', None)
+    if tags is not None:
+        tags.update(cache_tag(o) for o in objs)
+
+
+def namespace_tag(namespace):
+    """Dependency tag shared by every value of the namespace"""
+    if namespace not in CACHE_NAMESPACES:
+        raise ValueError('Unknown cache namespace: {namespace}'.format(namespace=namespace))
+    return 'namespace_{namespace}'.format(namespace=namespace)
+
+
+def namespaced_key(namespace, key):
+    return '{namespace}_{key}'.format(namespace=namespace, key=key)
+
+
+def flush_cache_namespace(*namespaces):
+    """
+    Invalidate whole namespaces in O(1)
+    :param namespaces: names from CACHE_NAMESPACES, all of them if empty
+    """
+    invalidate_cache_tags(*[namespace_tag(n) for n in namespaces or CACHE_NAMESPACES])
+
+
+def _get_local_tag_generations(tags):
+    """Like get_tag_generations, but trusts the values this process has read recently"""
+    generations = {}
+    missing = []
+    for tag in tags:
+        generation = _local_generations.get(tag)
+        if generation is None:
+            missing.append(tag)
+        else:
+            generations[tag] = generation
+    if missing:
+        for tag, generation in get_tag_generations(missing).items():
+            _local_generations.set(tag, generation)
+            generations[tag] = generation
+    return generations
+
+
+def get_cache_version(*objs, namespace=DEFAULT_CACHE_NAMESPACE):
+    """Short token which changes every time one of the objs or the namespace is invalidated"""
+    tags = sorted(set([cache_tag(o) for o in objs] + [namespace_tag(namespace)]))
+    add_cache_tags(*tags)
+    generations = get_tag_generations(tags)
+    return '.'.join(str(generations[tag]) for tag in tags)
+
+
+def invalidate_cache_tags(*objs):
+    """Evict every cached value that depends on one of the objs"""
+    for tag in set(cache_tag(o) for o in objs):
+        key = CACHE_GENERATION_KEY.format(tag=tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), None)
+        _local_generations.delete(tag)
+
+
+def _get_tagged_entry(key, tags):
+    """
+    :param tags: dependency tags, None to check the ones the entry was stored with
+    :return: (entry, fresh), entry is (generations, value, expires_at, delta) or None
+    """
+    if tags is None:
+        entry = cache.get(key)
+        if entry is None:
+            return None, False
+        tags = list(entry[0])
+        values = cache.get_many([CACHE_GENERATION_KEY.format(tag=tag) for tag in tags])
+    else:
+        add_cache_tags(*tags)
+        generation_keys = [CACHE_GENERATION_KEY.format(tag=tag) for tag in tags]
+        values = cache.get_many([key] + generation_keys)
+        entry = values.get(key)
+        if entry is None:
+            return None, False
+    generations, value, expires_at, delta = entry
+    if generations != get_tag_generations(tags, values):
+        return entry, False
+    return entry, expires_at is None or time.time() < expires_at
+
+
+def get_tagged_cache(key, tags, namespace=DEFAULT_CACHE_NAMESPACE):
+    """
+    Get a value stored by set_tagged_cache
+    :param key: cache key
+    :param tags: dependency tags of the value, None for the ones it was stored with
+    :param namespace: cache namespace
+    :return: (hit, value)
+    """
+    key = namespaced_key(namespace, key)
+    if tags is not None:
+        tags = [cache_tag(t) for t in tags] + [namespace_tag(namespace)]
+    entry, fresh = _get_tagged_entry(key, tags)
+    if not fresh:
+        return False, None
+    return True, entry[1]
+
+
+def _set_tagged_entry(key, value, tags, expiration, delta=0):
+    if expiration == DEFAULT_TIMEOUT:
+        expiration = cache.default_timeout
+    generations = get_tag_generations(tags)
+    if expiration is None:
+        entry = (generations, value, None, delta)
+        cache.set(key, entry, None)
+    else:
+        entry = (generations, value, time.time() + expiration, delta)
+        # kept a bit longer than asked, so the stale value can be served while it is recomputed
+        cache.set(key, entry, expiration + CACHE_STALE_TIMEOUT)
+    return entry
+
+
+def _set_local_entry(key, entry):
+    local_cache.set(key, entry)
+    for tag, generation in entry[0].items():
+        _local_generations.set(tag, generation)
+
+
+def set_tagged_cache(key, value, tags, expiration=DEFAULT_TIMEOUT, namespace=DEFAULT_CACHE_NAMESPACE):
+    """
+    Store a value together with the generations of the rows it was built from
+    :param key: cache key
+    :param value: value, None is allowed
+    :param tags: dependency tags, see cache_tag
+    :param expiration: timeout in seconds
+    :param namespace: cache namespace
+    """
+    key = namespaced_key(namespace, key)
+    tags = [cache_tag(t) for t in tags] + [namespace_tag(namespace)]
+    _set_tagged_entry(key, value, tags, expiration)
+
+
+def _should_refresh_early(entry):
+    """
+    Probabilistic early expiration (XFetch): the longer the value takes to compute
+    and the closer it is to expire, the more likely it is rebuilt now
+    """
+    generations, value, expires_at, delta = entry
+    if expires_at is None or not delta:
+        return False
+    return time.time() - delta * XFETCH_BETA * math.log(1 - random.random()) >= expires_at
+
+
+class CacheStats():
+    """Per-process counters of a cached function"""
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.compute_time = 0.0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'local_hits': self.local_hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'compute_time': self.compute_time,
+        }
+
+
+CACHE_STATS = {}
+CACHE_STATS_KEY = 'cache_stats_{process}'
+CACHE_STATS_PROCESSES_KEY = 'cache_stats_processes'
+# Seconds between two snapshots of the counters of a process written to the shared cache
+CACHE_STATS_PUBLISH_INTERVAL = 30
+_cache_stats_published_at = 0
+
+
+def get_cache_stats(name):
+    if name not in CACHE_STATS:
+        CACHE_STATS[name] = CacheStats(name)
+    return CACHE_STATS[name]
+
+
+def get_process_name():
+    return '{host}:{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+
+
+def publish_cache_stats(force=False):
+    """Write the counters of this process to the shared cache, at most once per CACHE_STATS_PUBLISH_INTERVAL"""
+    global _cache_stats_published_at
+    now = time.time()
+    if not force and now - _cache_stats_published_at < CACHE_STATS_PUBLISH_INTERVAL:
+        return
+    _cache_stats_published_at = now
+    process = get_process_name()
+    cache.set(CACHE_STATS_KEY.format(process=process),
+              {name: stats.as_dict() for name, stats in CACHE_STATS.items()}, 60 * 60 * 24)
+    processes = cache.get(CACHE_STATS_PROCESSES_KEY) or {}
+    processes = {p: seen for p, seen in processes.items() if now - seen < 60 * 60 * 24}
+    processes[process] = now
+    cache.set(CACHE_STATS_PROCESSES_KEY, processes, 60 * 60 * 24)
+
+
+def collect_cache_stats():
+    """
+    Counters published by every process
+    :return: {process: {function name: counters}}
+    """
+    processes = cache.get(CACHE_STATS_PROCESSES_KEY) or {}
+    keys = {CACHE_STATS_KEY.format(process=p): p for p in processes}
+    values = cache.get_many(list(keys))
+    return {keys[k]: v for k, v in values.items()}
+
+
+def summarize_cache_stats(processes):
+    """
+    Sum the counters of every process per function
+    :param processes: result of collect_cache_stats
+    :return: list of dicts sorted by function name
+    """
+    totals = {}
+    for counters in processes.values():
+        for name, values in counters.items():
+            total = totals.setdefault(name, {'name': name, 'hits': 0, 'local_hits': 0, 'misses': 0,
+                                             'stale_hits': 0, 'compute_time': 0.0})
+            for field in ('hits', 'local_hits', 'misses', 'stale_hits', 'compute_time'):
+                total[field] += values.get(field, 0)
+    for total in totals.values():
+        hits = total['hits'] + total['local_hits'] + total['stale_hits']
+        calls = hits + total['misses']
+        total['hit_rate'] = round(100.0 * hits / calls, 1) if calls else 0.0
+        total['avg_compute_ms'] = round(1000 * total['compute_time'] / total['misses'], 2) if total['misses'] else 0.0
+    return sorted(totals.values(), key=lambda t: t['name'])
+
+
+def get_or_set_tagged_cache(key, compute, tags, expiration=DEFAULT_TIMEOUT, namespace=DEFAULT_CACHE_NAMESPACE,
+                            early_refresh=False, stats=None, local=False):
+    """
+    Get a cached value or compute it, only one caller at a time recomputes a key:
+    the others get the stale value or wait a little for the new one
+    :param key: cache key
+    :param compute: callable without arguments building the value
+    :param tags: dependency tags, see cache_tag
+    :param expiration: timeout in seconds
+    :param namespace: cache namespace
+    :param early_refresh: rebuild hot values before they expire
+    :param stats: CacheStats to account the call in
+    :param local: keep the value in the in-process cache too, for tiny objects read many times per request.
+        The same instance is returned to every caller of the process, it must not be modified
+    :return: value
+    """
+    stats = stats or CacheStats(key)
+    key = namespaced_key(namespace, key)
+    tags = [cache_tag(t) for t in tags] + [namespace_tag(namespace)]
+    add_cache_tags(*tags)
+    if local:
+        entry = local_cache.get(key)
+        if entry is not None and (entry[2] is None or time.time() < entry[2]) \
+                and entry[0] == _get_local_tag_generations(tags):
+            stats.local_hits += 1
+            return entry[1]
+
+    entry, fresh = _get_tagged_entry(key, tags)
+    if fresh and not (early_refresh and _should_refresh_early(entry)):
+        stats.hits += 1
+        if local:
+            _set_local_entry(key, entry)
+        return entry[1]
+
+    def recompute():
+        start_time = time.time()
+        value = compute()
+        delta = time.time() - start_time
+        stats.misses += 1
+        stats.compute_time += delta
+        return value, delta
+
+    lock_key = key + '_lock'
+    if cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+        try:
+            value, delta = recompute()
+            entry = _set_tagged_entry(key, value, tags, expiration, delta)
+            if local:
+                _set_local_entry(key, entry)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    if entry is not None:
+        # somebody else is rebuilding it
+        stats.stale_hits += 1
+        return entry[1]
+    deadline = time.time() + CACHE_LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry, fresh = _get_tagged_entry(key, tags)
+        if fresh:
+            stats.hits += 1
+            return entry[1]
+    logger.warning('cache lock wait timed out, key:{key}'.format(key=key))
+    return recompute()[0]
+
+
+def _cache_key_part(value):
+    if isinstance(value, models.Model):
+        return cache_tag(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return '[{items}]'.format(items=','.join(_cache_key_part(v) for v in value))
+    if isinstance(value, dict):
+        return '{{{items}}}'.format(items=','.join(
+            '{k}:{v}'.format(k=_cache_key_part(k), v=_cache_key_part(v)) for k, v in sorted(value.items())))
+    return repr(value)
+
+
+def make_cache_key(func, args, kwargs):
+    """
+    Key which is the same in every process: qualified name of the function,
+    label and pk of model instances and repr of the other arguments
+    """
+    parts = [_cache_key_part(a) for a in args]
+    parts += ['{k}={v}'.format(k=k, v=_cache_key_part(v)) for k, v in sorted(kwargs.items())]
+    return '{name}_{args}'.format(name=get_function_name(func), args=get_md5(','.join(parts)))
+
+
+def get_function_name(func):
+    return '{module}.{name}'.format(module=func.__module__, name=func.__qualname__)
+
+
+def cache_decorator(expiration=3 * 60, depends_on=(), namespace=DEFAULT_CACHE_NAMESPACE, early_refresh=False,
+                    key=None, local=False):
+    """
+    Cache the result of a function
+    :param expiration: timeout in seconds
+    :param depends_on: models (labels or classes) the result is built from,
+        a model instance passed as the first argument is added automatically
+    :param namespace: cache namespace, see CACHE_NAMESPACES
+    :param early_refresh: rebuild the value before it expires, for hot keys
+    :param key: cache key, or callable building it from the arguments of the function
+    :param local: keep the result in the in-process cache too, see get_or_set_tagged_cache
+    """
     def wrapper(func):
+        stats = get_cache_stats(get_function_name(func))
+
+        @functools.wraps(func)
         def news(*args, **kwargs):
-            try:
-                view = args[0]
-                key = view.get_cache_key()
-            except:
-                key = None
-            if not key:
-                unique_str = repr((func, args, kwargs))
-
-                m = md5(unique_str.encode('utf-8'))
-                key = m.hexdigest()
-            value = cache.get(key)
-            if value is not None:
-                # logger.info('cache_decorator get cache:%s key:%s' % (func.__name__, key))
-                if str(value) == '__default_cache_value__':
-                    return None
-                else:
-                    return value
+            if key is None:
+                cache_key = make_cache_key(func, args, kwargs)
+            elif callable(key):
+                cache_key = key(*args, **kwargs)
             else:
-                # logger.debug('cache_decorator set cache:%s key:%s' % (func.__name__, key))
-                value = func(*args, **kwargs)
-                if value is None:
-                    cache.set(key, '__default_cache_value__', expiration)
-                else:
-                    cache.set(key, value, expiration)
-                return value
+                cache_key = key
+            tags = [cache_tag(d) for d in depends_on]
+            if args and isinstance(args[0], models.Model):
+                tags.append(cache_tag(args[0]))
+            value = get_or_set_tagged_cache(cache_key, lambda: func(*args, **kwargs), tags, expiration, namespace,
+                                            early_refresh, stats, local)
+            publish_cache_stats()
+            return value
+
+        news.cache_stats = stats
+        return news
+
+    return wrapper
+
+
+def cache_response(expiration=60 * 60, depends_on=(), namespace='feeds'):
+    """
+    Cache the whole response of a view which does not depend on the user, e.g. feeds and sitemaps
+    :param expiration: timeout in seconds
+    :param depends_on: models the response is built from
+    :param namespace: cache namespace
+    """
+    def wrapper(view):
+        def news(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            key = 'response_' + get_md5(request.get_host() + request.get_full_path())
+            tags = [cache_tag(d) for d in depends_on]
+            hit, value = get_tagged_cache(key, tags, namespace)
+            if hit:
+                content, content_type = value
+                return HttpResponse(content, content_type=content_type)
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            if response.status_code == 200 and not response.streaming:
+                set_tagged_cache(key, (response.content, response['Content-Type']), tags, expiration, namespace)
+            return response
+
+        return news
+
+    return wrapper
+
 
+def page_cache(expiration=60 * 60, on_hit=None):
+    """
+    Let PageCacheMiddleware keep whole pages of the view for anonymous visitors
+    :param expiration: timeout in seconds, the page is purged earlier when anything it shows changes
+    :param on_hit: callable(request, *args, **kwargs) run instead of the view when the page is served
+        from the cache, for side effects such as counting views
+    """
+    def wrapper(view):
+        @functools.wraps(view)
+        def news(request, *args, **kwargs):
+            return view(request, *args, **kwargs)
+
+        news.page_cache_timeout = expiration
+        news.page_cache_on_hit = on_hit
         return news
 
     return wrapper
 
 
+def conditional_page(last_modified_func, depends_on=(), version_func=None):
+    """
+    Answer revalidation requests with 304 before the view renders anything
+    :param last_modified_func: callable(request, *args, **kwargs) returning the latest modification time
+        of the rows the page shows
+    :param depends_on: models the rest of the page (sidebar, navigation) is built from, their versions
+        and the blog settings version are part of the ETag
+    :param version_func: callable(request) returning the version of the cached fragments the page includes,
+        e.g. the sidebar, part of the ETag too
+    """
+    def get_last_modified(request, *args, **kwargs):
+        if request.COOKIES.get('messages'):
+            # pending messages are rendered into the page
+            return None
+        if not hasattr(request, '_page_last_modified'):
+            request._page_last_modified = last_modified_func(request, *args, **kwargs)
+        return request._page_last_modified
+
+    def get_etag(request, *args, **kwargs):
+        if request.COOKIES.get('messages'):
+            return None
+        last_modified = get_last_modified(request, *args, **kwargs)
+        version = get_cache_version('blog.blogsettings', *depends_on, namespace='settings')
+        if version_func:
+            version = '{version}:{fragments}'.format(version=version, fragments=version_func(request))
+        user = request.user.pk if request.user.is_authenticated else ''
+        return get_md5('{last_modified}:{version}:{user}'.format(last_modified=last_modified, version=version,
+                                                                  user=user))
+
+    return condition(etag_func=get_etag, last_modified_func=get_last_modified)
+
+
 def expire_view_cache(path, servername, serverport, key_prefix=None):
     '''
     Flush preliminary cache
@@ -81,23 +654,37 @@ def expire_view_cache(path, servername, serverport, key_prefix=None):
         return True
     return False
 
-@cache_decorator()
+@cache_decorator(depends_on=('sites.site',), namespace='site', key='current_site', local=True)
 def get_current_site():
     site = Site.objects.get_current()
     return site
 
 
-@cache_decorator()
+@cache_decorator(depends_on=('sites.site',), namespace='site', key='current_site_domain', local=True)
 def get_current_site_domain():
     if settings.DEBUG:
         return '127.0.0.1:8000'
     return Site.objects.get_current().domain
 
 class CommonMarkdown():
+    # Bump when the renderer or its extras change, then run the render_markdown command
+    VERSION = 1
+
     @staticmethod
     def get_markdown(content):
         return markdown2.markdown(content, extras=["tables", "cuddled-lists", "fenced-code-blocks"])
 
+    @staticmethod
+    def get_markdown_hash(content):
+        """Identifies the HTML rendered from content by the current renderer"""
+        return get_md5('{version}:{content}'.format(version=CommonMarkdown.VERSION, content=content))
+
+    @staticmethod
+    def get_cached_markdown(content):
+        """Rendered content, cached by content hash"""
+        return get_or_set_tagged_cache(CommonMarkdown.get_markdown_hash(content),
+                                       lambda: CommonMarkdown.get_markdown(content), [], 60 * 60 * 24, 'markdown')
+
 def render_template(template, **kwargs):
     ''' renders a Jinja template into HTML '''
     # check if template exists
@@ -125,34 +712,30 @@ def parse_dict_to_url(dict):
     return url
 
 
+@cache_decorator(60 * 60 * 10, depends_on=('blog.blogsettings',), namespace='settings', key='get_blog_setting',
+                 local=True)
 def get_blog_setting():
-    value = cache.get('get_blog_setting')
-    if value:
-        return value
-    else:
-        from blog.models import BlogSettings
-        if not BlogSettings.objects.count():
-            setting = BlogSettings()
-            setting.sitename = 'mtuktarov empire'
-            setting.site_description = 'if I had my own world...'
-            setting.site_seo_description = 'mtuktarov'
-            setting.site_keywords = 'love,hope,truth'
-            setting.article_sub_length = 300
-            setting.sidebar_article_count = 10
-            setting.sidebar_comment_count = 5
-            setting.show_google_adsense = False
-            setting.enable_site_comment = True
-            setting.analyticscode = ''
-            setting.footer_title = 'if I had my own world...'
-            setting.show_views_bar = False
-            setting.show_category_bar = False
-            setting.show_search_bar = False
-            setting.show_menu_bar = False
-            setting.save()
-        value = BlogSettings.objects.first()
-        # logger.debug('set cache get_blog_setting')
-        cache.set('get_blog_setting', value)
-        return value
+    from blog.models import BlogSettings
+    if not BlogSettings.objects.count():
+        setting = BlogSettings()
+        setting.sitename = 'mtuktarov empire'
+        setting.site_description = 'if I had my own world...'
+        setting.site_seo_description = 'mtuktarov'
+        setting.site_keywords = 'love,hope,truth'
+        setting.article_sub_length = 300
+        setting.sidebar_article_count = 10
+        setting.sidebar_comment_count = 5
+        setting.show_google_adsense = False
+        setting.enable_site_comment = True
+        setting.analyticscode = ''
+        setting.footer_title = 'if I had my own world...'
+        setting.show_views_bar = False
+        setting.show_category_bar = False
+        setting.show_search_bar = False
+        setting.show_menu_bar = False
+        setting.save()
+    value = BlogSettings.objects.first()
+    return value
 
 
 def save_user_avatar(url):
@@ -195,10 +778,17 @@ def save_user_avatar(url):
         return url
 
 
-def delete_sidebar_cache(username):
+# Everything the sidebar displays, see blog_tags.load_sidebar
+SIDEBAR_CACHE_DEPENDENCIES = ('blog.article', 'blog.category', 'blog.tag', 'blog.links', 'blog.sidebar',
+                              'blog.blogsettings', 'comments.comment', 'accounts.bloguser')
+
+
+def delete_sidebar_cache():
+    """Drop the shared sidebar fragments, one per link type"""
     from django.core.cache.utils import make_template_fragment_key
     from blog.models import LINK_SHOW_TYPE
-    keys = (make_template_fragment_key('sidebar', [username + x[0]]) for x in LINK_SHOW_TYPE)
+    version = get_cache_version(*SIDEBAR_CACHE_DEPENDENCIES, namespace='sidebar')
+    keys = (make_template_fragment_key('sidebar', [x[0], version]) for x in LINK_SHOW_TYPE)
     for k in keys:
         # logger.debug('delete sidebar key:' + k)
         cache.delete(k)
@@ -26,6 +26,10 @@ class AccountTest(TestCase):
         self.assertEqual(loginresult, True)
         response = self.client.get('/admin/')
         self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('admin:cache_stats'))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('admin:latency_stats'))
+        self.assertContains(response, 'admin:cache_stats')
 
         category = Category()
         category.name = "categoryaaa"
@@ -66,7 +70,7 @@ class AccountTest(TestCase):
         user.is_superuser = True
         user.is_staff = True
         user.save()
-        delete_sidebar_cache(user.username)
+        delete_sidebar_cache()
         category = Category()
         category.name = "categoryaaa"
         category.created_time = datetime.datetime.now()
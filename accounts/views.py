@@ -81,8 +81,6 @@ class LogoutView(RedirectView):
         return super(LogoutView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        from DjangoBlog.utils import cache
-        cache.clear()
         logout(request)
         return super(LogoutView, self).get(request, *args, **kwargs)
 
@@ -133,10 +131,6 @@ class LoginView(FormView):
         form = CustomAuthForm(data=self.request.POST, request=self.request)
 
         if form.is_valid():
-            from DjangoBlog.utils import cache
-            if cache and cache is not None:
-                cache.clear()
-
             auth.login(self.request, form.get_user())
             if self.request.is_ajax():
                 logger.info("ajax succesfull login request")
@@ -6,6 +6,8 @@ from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from django.urls import reverse
 from django.utils.html import format_html
+from django.utils.timezone import now
+from DjangoBlog.utils import invalidate_cache_tags
 
 
 class ArticleListFilter(admin.SimpleListFilter):
@@ -34,19 +36,24 @@ class ArticleForm(forms.ModelForm):
 
 
 def makr_article_publish(modeladmin, request, queryset):
-    queryset.update(status='p')
+    queryset.update(status='p', last_mod_time=now())
+    # update() sends no post_save, so the cached pages are invalidated here
+    invalidate_cache_tags(Article, *queryset)
 
 
 def draft_article(modeladmin, request, queryset):
-    queryset.update(status='d')
+    queryset.update(status='d', last_mod_time=now())
+    invalidate_cache_tags(Article, *queryset)
 
 
 def close_article_commentstatus(modeladmin, request, queryset):
-    queryset.update(comment_status='c')
+    queryset.update(comment_status='c', last_mod_time=now())
+    invalidate_cache_tags(Article, *queryset)
 
 
 def open_article_commentstatus(modeladmin, request, queryset):
-    queryset.update(comment_status='o')
+    queryset.update(comment_status='o', last_mod_time=now())
+    invalidate_cache_tags(Article, *queryset)
 
 
 makr_article_publish.short_description = 'Опубликовать выбранную статью'
@@ -63,7 +70,7 @@ class ArticlelAdmin(admin.ModelAdmin):
     search_fields = ('body', 'title')
     form = ArticleForm
     list_display = (
-        'id', 'title', 'author', 'created_time', 'views', 'status', 'type', 'article_order', 'link_to_category')
+        'id', 'title', 'author', 'created_time', 'views', 'unique_visitors', 'status', 'type', 'article_order', 'link_to_category')
     list_display_links = ('id', 'title')
     list_filter = (ArticleListFilter, 'status', 'type', 'category', 'tags')
     filter_horizontal = ('tags',)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 from .models import Category, Article, Tag, BlogSettings
-from DjangoBlog.utils import cache, get_blog_setting
+from DjangoBlog.utils import get_blog_setting, get_tagged_cache, set_tagged_cache
 from datetime import datetime
 import logging
 
@@ -10,8 +10,9 @@ logger = logging.getLogger(__name__)
 
 def seo_processor(requests):
     key = 'seo_processor'
-    value = cache.get(key)
-    if value:
+    tags = [BlogSettings, Category, Article]
+    hit, value = get_tagged_cache(key, tags, 'settings')
+    if hit and value:
         return value
     else:
         # logger.debug('set processor cache.')
@@ -33,5 +34,5 @@ def seo_processor(requests):
             "CURRENT_YEAR": datetime.now().year,
             "SHOW_CATEGORY_BAR": setting.show_category_bar,
         }
-        cache.set(key, value, 60 * 60 * 10)
+        set_tagged_cache(key, value, tags, 60 * 60 * 10, 'settings')
         return value
@@ -1,15 +1,25 @@
 #!/usr/bin/env python
 
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
 import time
+import uuid
 from blog.models import Article, Category, Tag
 from elasticsearch_dsl import Document, Date, Integer, Keyword, Text, Object, Boolean
 
 from django.conf import settings
+from django.db.models import QuerySet, prefetch_related_objects
 
 ELASTICSEARCH_ENABLED = hasattr(settings, 'ELASTICSEARCH_DSL')
 
 from elasticsearch_dsl.connections import connections
 
+logger = logging.getLogger(__name__)
+
 if ELASTICSEARCH_ENABLED:
     connections.create_connection(hosts=[settings.ELASTICSEARCH_DSL['default']['hosts']])
 
@@ -32,16 +42,74 @@ class ElapsedTimeDocument(Document):
         doc_type = 'ElapsedTime'
 
 
+class ElapsedTimeShipper():
+    """
+    Bounded queue of documents indexed by a background thread with the bulk API,
+    so a request never waits on Elasticsearch. Documents put while the queue is full are dropped
+    """
+
+    def __init__(self, queue_size, batch_size, flush_interval):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # uwsgi forks the workers after loading the app, a thread of the parent doesn't exist in the child
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name='elapsed-time-shipper', daemon=True).start()
+
+    def put(self, doc):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(doc)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        q = self.queue
+        while True:
+            batch = [q.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self.ship(batch)
+            except Exception as e:
+                logger.error('elapsed time bulk index of %d documents failed: %s', len(batch), e)
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    def ship(self, batch):
+        from elasticsearch.helpers import bulk
+        bulk(connections.get_connection(), (doc.to_dict(include_meta=True) for doc in batch), raise_on_error=False)
+
+
 class ElaspedTimeDocumentManager():
+    shipper = ElapsedTimeShipper(settings.ELAPSED_TIME_QUEUE_SIZE, settings.ELAPSED_TIME_BATCH_SIZE,
+                                 settings.ELAPSED_TIME_FLUSH_INTERVAL)
 
     @staticmethod
     def create(url, time_taken, log_datetime, type, useragent):
         # if not hasattr(ElaspedTimeDocumentManager, 'mapping_created'):
         #     ElapsedTimeDocument.init()
         #     setattr(ElaspedTimeDocumentManager, 'mapping_created', True)
-        doc = ElapsedTimeDocument(meta={'id': int(round(time.time() * 1000))}, url=url, time_taken=time_taken,
+        if random.random() >= settings.ELAPSED_TIME_SAMPLE_RATE:
+            return
+        doc = ElapsedTimeDocument(meta={'id': uuid.uuid4().hex}, url=url, time_taken=time_taken,
                                   log_datetime=log_datetime, type=type, useragent=useragent)
-        doc.save()
+        ElaspedTimeDocumentManager.shipper.put(doc)
 
 
 class ArticleDocument(Document):
@@ -92,32 +160,84 @@ class ArticleDocumentManager():
         es = Elasticsearch(settings.ELASTICSEARCH_DSL['default']['hosts'])
         es.indices.delete(index='blog', ignore=[400, 404])
 
+    def convert_article(self, article):
+        category = article.category
+        return ArticleDocument(meta={'id': article.id}, body=article.body, title=article.title,
+                               author={'nikename': article.author.username, 'id': article.author.id},
+                               category={'name': category.name, 'id': category.id} if category else None,
+                               tags=[{'name': t.name, 'id': t.id} for t in article.tags.all()],
+                               pub_time=article.pub_time,
+                               status=article.status,
+                               comment_status=article.comment_status,
+                               type=article.type,
+                               views=article.views,
+                               article_order=article.article_order)
+
     def convert_to_doc(self, articles):
-        return [ArticleDocument(meta={'id': article.id}, body=article.body, title=article.title,
-                                author={
-                                    'nikename': article.author.username,
-                                    'id': article.author.id
-        },
-            category={
-                                    'name': article.category.name,
-                                    'id': article.category.id
-        },
-            tags=[{'name': t.name, 'id': t.id} for t in article.tags.all()],
-            pub_time=article.pub_time,
-            status=article.status,
-            comment_status=article.comment_status,
-            type=article.type,
-            views=article.views,
-            article_order=article.article_order
-        ) for article in articles]
-
-    def rebuild(self, articles=None):
+        return [self.convert_article(article) for article in articles]
+
+    def iter_articles(self, articles=None, chunk_size=None):
+        """
+        Articles read in chunks, with their author, category and tags loaded by the same few queries per chunk
+        :param articles: queryset or list of articles, all of them by default
+        """
+        chunk_size = chunk_size or settings.ELASTICSEARCH_INDEX_CHUNK_SIZE
+        if articles is None or isinstance(articles, QuerySet):
+            queryset = (Article.objects.all() if articles is None else articles) \
+                .select_related('author', 'category').prefetch_related('tags').order_by('pk')
+            last_pk = 0
+            while True:
+                chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    return
+                yield from chunk
+                last_pk = chunk[-1].pk
+        else:
+            articles = iter(articles)
+            while True:
+                chunk = list(itertools.islice(articles, chunk_size))
+                if not chunk:
+                    return
+                prefetch_related_objects(chunk, 'author', 'category', 'tags')
+                yield from chunk
+
+    def bulk_index(self, articles=None, chunk_size=None, thread_count=None, progress=None):
+        """
+        Stream the articles to the bulk helpers, by parallel_bulk with more than one thread,
+        except for a list shorter than a chunk such as the article saved by the signal processor
+        :param progress: called with the number of articles sent after every chunk
+        :return: (indexed, failed)
+        """
+        from elasticsearch.helpers import streaming_bulk, parallel_bulk
+        chunk_size = chunk_size or settings.ELASTICSEARCH_INDEX_CHUNK_SIZE
+        thread_count = thread_count or settings.ELASTICSEARCH_INDEX_THREADS
+        actions = (self.convert_article(article).to_dict(include_meta=True)
+                   for article in self.iter_articles(articles, chunk_size))
+        client = connections.get_connection()
+        if isinstance(articles, (list, tuple)) and len(articles) < chunk_size:
+            # a single request, a pool of threads would only slow it down
+            thread_count = 1
+        if thread_count > 1:
+            results = parallel_bulk(client, actions, thread_count=thread_count, chunk_size=chunk_size,
+                                    raise_on_error=False)
+        else:
+            results = streaming_bulk(client, actions, chunk_size=chunk_size, raise_on_error=False)
+        indexed = failed = 0
+        for ok, item in results:
+            if ok:
+                indexed += 1
+            else:
+                failed += 1
+                logger.error('article index failed: %s', item)
+            if progress and (indexed + failed) % chunk_size == 0:
+                progress(indexed + failed)
+        if progress:
+            progress(indexed + failed)
+        return indexed, failed
+
+    def rebuild(self, articles=None, **kwargs):
+        """
+        :param kwargs: arguments of bulk_index
+        """
         ArticleDocument.init()
-        articles = articles if articles else Article.objects.all()
-        docs = self.convert_to_doc(articles)
-        for doc in docs:
-            doc.save()
-
-    def update_docs(self, docs):
-        for doc in docs:
-            doc.save()
+        return self.bulk_index(articles, **kwargs)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import math
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from blog.models import Article, Category, Tag
+from DjangoBlog.benchmark import Timer, percentiles, cache_stats_snapshot, cache_hit_rate, compare_to_baseline, \
+    load_baseline, save_baseline
+
+
+class Command(BaseCommand):
+    help = 'Request the main pages through the test client and report requests/sec, latency percentiles, ' \
+           'queries per request and cache hit rate, run it on the data of generate_benchdata. ' \
+           'The anonymous pages are mostly page cache hits unless --no-page-cache or --user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per page')
+        parser.add_argument('--warmup', type=int, default=5, help='Requests per page before measuring')
+        parser.add_argument('--user', help='Request as this user, the page cache only serves anonymous visitors')
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Leave PageCacheMiddleware out, to measure the views behind it')
+        parser.add_argument('--write', action='store_true',
+                            help='Post comments too, they are rolled back but the caches are invalidated')
+        parser.add_argument('--baseline', help='JSON of an earlier run to compare with')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Change flagged as a regression')
+
+    def handle(self, *args, **options):
+        if options['no_page_cache']:
+            middleware = [m for m in settings.MIDDLEWARE if m != 'blog.middleware.PageCacheMiddleware']
+            with override_settings(MIDDLEWARE=middleware):
+                return self.run(options)
+        return self.run(options)
+
+    def run(self, options):
+        # the client loads the middleware on its first request
+        client = Client(HTTP_USER_AGENT='Mozilla/5.0 (benchmark)')
+        if options['user']:
+            client.force_login(get_user_model().objects.get(username=options['user']))
+        results = {}
+        for name, method, url, data in self.get_pages(options['write']):
+            # the comments posted are not kept
+            with transaction.atomic():
+                results[name] = self.measure(client, method, url, data, options['requests'], options['warmup'])
+                transaction.set_rollback(method == 'post')
+            self.report(name, results[name])
+
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], results)
+        if options['baseline']:
+            regressions = compare_to_baseline(results, load_baseline(options['baseline']), options['threshold'])
+            if regressions:
+                raise CommandError('regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('no regression over {0:.0%}'.format(options['threshold'])))
+
+    def get_pages(self, write):
+        """:return: [(name, method, url, data)] of the pages of the most populated objects"""
+        articles = Article.objects.filter(status='p', type='a')
+        article = articles.annotate(comments=Count('comment')).order_by('-comments').first()
+        if article is None:
+            raise CommandError('No article, run generate_benchdata first')
+        last_page = max(math.ceil(articles.count() / settings.PAGINATE_BY), 1)
+        category = Category.objects.annotate(articles=Count('article')).order_by('-articles').first()
+        tag = Tag.objects.annotate(articles=Count('article')).order_by('-articles').first()
+        pages = [
+            ('index', 'get', reverse('blog:index'), None),
+            ('index_middle', 'get', reverse('blog:index_page', kwargs={'page': max(last_page // 2, 1)}), None),
+            ('index_last', 'get', reverse('blog:index_page', kwargs={'page': last_page}), None),
+            ('category', 'get', category.get_absolute_url(), None),
+            ('tag', 'get', tag.get_absolute_url(), None) if tag else None,
+            ('article', 'get', article.get_absolute_url(), None),
+            ('search', 'get', '/search', {'q': max(article.title.split(), key=len)}),
+            ('feed', 'get', '/feed/', None),
+            ('sitemap', 'get', '/sitemap.xml', None),
+        ]
+        if write:
+            pages.append(('comment_post', 'post', reverse('comments:postcomment', kwargs={'article_id': article.id}),
+                          {'body': 'benchmark comment', 'email': 'benchmark@example.com', 'name': 'benchmark'}))
+        return [p for p in pages if p]
+
+    def measure(self, client, method, url, data, count, warmup):
+        request = getattr(client, method)
+        queries = []
+        statuses = set()
+
+        def fetch():
+            response = request(url, data)
+            statuses.add(response.status_code)
+            queries.append(response.queries.count)
+
+        for _ in range(warmup):
+            fetch()
+        queries.clear()
+        before = cache_stats_snapshot()
+        timer = Timer()
+        timer.run(fetch, count)
+        result = {
+            'url': url,
+            'status': sorted(statuses),
+            'requests': count,
+            'rps': timer.per_second(),
+            'queries': round(sum(queries) / float(len(queries)), 2) if queries else 0,
+            'cache_hit_rate': cache_hit_rate(before, cache_stats_snapshot()),
+        }
+        result.update(percentiles(timer.durations))
+        return result
+
+    def report(self, name, result):
+        self.stdout.write('{name:<14} {rps:>8} req/s  p50 {p50:>8} ms  p95 {p95:>8} ms  p99 {p99:>8} ms  '
+                          '{queries:>6} queries  cache hits {hit_rate}%  status {status}'.format(
+                              name=name, hit_rate=result['cache_hit_rate'], **result))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import random
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db.models import Count
+from django.template import Context, Template
+from blog.models import Article, Category, Tag
+from blog.templatetags.blog_tags import custom_markdown, truncatechars_content, gravatar_url
+from comments.models import Comment
+from comments.templatetags.comments_tags import parse_commenttree
+from oauth.models import OAuthUser
+from DjangoBlog.benchmark import measure_op, empty_caches, compare_to_baseline, load_baseline, save_baseline, \
+    markdown
+
+SIDEBAR_TEMPLATE = Template('{% load blog_tags %}{% load_sidebar linktype %}')
+PAGINATION_TEMPLATE = Template('{% load blog_tags %}{% load_pagination_info page_obj page_type tag_name %}')
+
+
+class Command(BaseCommand):
+    help = 'Time the template tags of the hot paths alone with a warm and a cold cache: ns per call, ' \
+           'allocated bytes and queries, run it on the data of generate_benchdata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100, help='Calls per measure')
+        parser.add_argument('--sizes', default='5,50,500', help='Markdown blocks or emails, comma separated')
+        parser.add_argument('--only', help='Tags to time, comma separated')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', help='JSON of an earlier run to compare with')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Change flagged as a regression')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        only = set(options['only'].split(',')) if options['only'] else None
+        results = {}
+        for name, size, func in self.get_cases(sizes):
+            if only and name not in only:
+                continue
+            for mode in ('warm', 'cold'):
+                if mode == 'warm':
+                    func()
+                result = measure_op(func, options['count'], empty_caches if mode == 'cold' else None)
+                key = '{name}[{size}]/{mode}'.format(name=name, size=size, mode=mode)
+                results[key] = result
+                self.stdout.write('{key:<48} {ns_per_op:>12} ns/op {peak_bytes:>10} B peak '
+                                  '{retained_bytes:>8} B retained {queries:>7} queries'.format(key=key, **result))
+
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], results)
+        if options['baseline']:
+            regressions = compare_to_baseline(results, load_baseline(options['baseline']), options['threshold'])
+            if regressions:
+                raise CommandError('regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('no regression over {0:.0%}'.format(options['threshold'])))
+
+    def get_cases(self, sizes):
+        """:return: [(tag name, size, function of no argument)]"""
+        cases = []
+        for size in sizes:
+            text = markdown(self.rng, size)
+            cases.append(('custom_markdown', size, lambda text=text: custom_markdown(text)))
+            cases.append(('truncatechars_content', size, lambda text=text: truncatechars_content(text)))
+
+        emails = list(OAuthUser.objects.exclude(email=None).values_list('email', flat=True)[:max(sizes)])
+        for size in sizes:
+            addresses = (emails[:size] + ['visitor{0}@example.com'.format(i) for i in range(size)])[:size]
+            cases.append(('gravatar_url', size, lambda addresses=addresses: [gravatar_url(e) for e in addresses]))
+
+        for linktype in ('i', 'p'):
+            cases.append(('load_sidebar', linktype,
+                          lambda linktype=linktype: SIDEBAR_TEMPLATE.render(Context({'linktype': linktype}))))
+
+        articles = Article.objects.filter(status='p', type='a')
+        pages = [('index', '', '', articles)]
+        category = Category.objects.annotate(articles=Count('article')).order_by('-articles').first()
+        if category:
+            pages.append(('category', 'Категория', category.name, articles.filter(category=category)))
+        tag = Tag.objects.annotate(articles=Count('article')).order_by('-articles').first()
+        if tag:
+            pages.append(('tag', 'Тег', tag.name, articles.filter(tags=tag)))
+        for name, page_type, tag_name, queryset in pages:
+            paginator = Paginator(queryset.order_by('-pub_time'), settings.PAGINATE_BY)
+            page_obj = paginator.page(max(paginator.num_pages // 2, 1))
+            context = {'page_obj': page_obj, 'page_type': page_type, 'tag_name': tag_name}
+            cases.append(('load_pagination_info', name,
+                          lambda context=context: PAGINATION_TEMPLATE.render(Context(context))))
+
+        article = Article.objects.annotate(comments=Count('comment')).order_by('-comments').first()
+        if article:
+            comments = Comment.objects.filter(article=article, is_enabled=True)
+            roots = list(comments.filter(parent_comment=None))
+            cases.append(('parse_commenttree', comments.count(),
+                          lambda: [parse_commenttree(comments, c) for c in roots]))
+        return cases
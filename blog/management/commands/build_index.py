@@ -1,18 +1,33 @@
 #!/usr/bin/env python
 
 from blog.documents import ElapsedTimeDocument, ArticleDocumentManager
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from blog.models import Article
 
 
-# TODO parameterize
 class Command(BaseCommand):
     help = 'Задать индекс поиска'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.ELASTICSEARCH_INDEX_CHUNK_SIZE,
+                            help='Articles read and sent per bulk request')
+        parser.add_argument('--threads', type=int, default=settings.ELASTICSEARCH_INDEX_THREADS,
+                            help='Bulk requests sent at once')
+
     def handle(self, *args, **options):
+        total = Article.objects.count()
+
+        def progress(sent):
+            self.stdout.write('indexed {sent}/{total}'.format(sent=sent, total=total))
+
         manager = ArticleDocumentManager()
         manager.delete_index()
-        manager.rebuild()
+        indexed, failed = manager.rebuild(chunk_size=options['chunk_size'], thread_count=options['threads'],
+                                          progress=progress)
+        if failed:
+            self.stderr.write('{failed} articles not indexed, see the log'.format(failed=failed))
 
         manager = ElapsedTimeDocument()
         manager.init()
+        self.stdout.write(self.style.SUCCESS('indexed {indexed} articles'.format(indexed=indexed)))
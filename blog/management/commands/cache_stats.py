@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+from DjangoBlog.utils import collect_cache_stats, summarize_cache_stats
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Show hits, misses and compute time of the cached functions of every worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-process', action='store_true', help='Show every worker separately')
+
+    def handle(self, *args, **options):
+        processes = collect_cache_stats()
+        if not processes:
+            self.stdout.write('No cache statistics published yet')
+            return
+        groups = [(p, {p: processes[p]}) for p in sorted(processes)] if options['per_process'] \
+            else [('all processes: ' + ', '.join(sorted(processes)), processes)]
+        for title, group in groups:
+            self.stdout.write(self.style.SUCCESS(title))
+            self.stdout.write('{:<60} {:>8} {:>8} {:>8} {:>8} {:>7} {:>10}'.format(
+                'function', 'hits', 'local', 'stale', 'misses', 'hit %', 'avg ms'))
+            for s in summarize_cache_stats(group):
+                self.stdout.write('{name:<60} {hits:>8} {local_hits:>8} {stale_hits:>8} {misses:>8} {hit_rate:>7} '
+                                  '{avg_compute_ms:>10}'.format(**s))
@@ -1,12 +1,25 @@
 #!/usr/bin/env python
 
-from DjangoBlog.utils import cache
-from django.core.management.base import BaseCommand
+from DjangoBlog.utils import cache, flush_cache_namespace, CACHE_NAMESPACES
+from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
     help = 'Удалить весь кэш'
 
+    def add_arguments(self, parser):
+        parser.add_argument('namespaces', nargs='*',
+                            help='Cache namespaces to flush, all of them if omitted')
+        parser.add_argument('--hard', action='store_true',
+                            help='Clear the whole cache server, including robot sessions')
+
     def handle(self, *args, **options):
-        cache.clear()
+        unknown = [n for n in options['namespaces'] if n not in CACHE_NAMESPACES]
+        if unknown:
+            raise CommandError('Unknown cache namespaces: {unknown}, choose from {namespaces}'.format(
+                unknown=', '.join(unknown), namespaces=', '.join(CACHE_NAMESPACES)))
+        if options['hard']:
+            cache.clear()
+        else:
+            flush_cache_namespace(*options['namespaces'])
         self.stdout.write(self.style.SUCCESS('Кэш удален\n'))
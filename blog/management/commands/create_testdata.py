@@ -36,6 +36,6 @@ class Command(BaseCommand):
             article.tags.add(basetag)
             article.save()
 
-        from DjangoBlog.utils import cache
-        cache.clear()
+        from DjangoBlog.utils import flush_cache_namespace
+        flush_cache_namespace()
         self.stdout.write(self.style.SUCCESS('created test datas \n'))
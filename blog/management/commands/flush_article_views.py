@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+
+from django.core.management.base import BaseCommand
+from blog.models import Article, pop_dirty_articles
+from blog.visitors import flush_visitors
+
+
+class Command(BaseCommand):
+    help = 'Write the article views and unique visitors counted in the cache to the database, run it periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # the views and the visitors share the log of the articles counted since the last run
+        ids = pop_dirty_articles()
+        flushed = Article.flush_views(ids, options['batch_size'])
+        updated = flush_visitors(ids, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{count} views written, unique visitors of {articles} articles updated'
+                                             .format(count=flushed, articles=updated)))
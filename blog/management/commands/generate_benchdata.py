@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import datetime
+import itertools
+import random
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from uuslug import slugify
+from blog.models import Article, Category, Tag
+from comments.models import Comment
+from oauth.models import OAuthUser
+from DjangoBlog.utils import flush_cache_namespace
+from DjangoBlog.benchmark import sentence, markdown
+
+OAUTH_TYPES = ('weibo', 'google', 'github', 'facebook', 'qq')
+START_TIME = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Command(BaseCommand):
+    help = 'Generate volumes of articles, categories, tags, threaded comments and users for capacity testing, ' \
+           'e.g. --articles 100000 --tags 5000 --comments 2000000 --users 20000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--tags', type=int, default=500)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--oauth-users', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0, help='The same seed generates the same data')
+        parser.add_argument('--prefix', default='bench', help='Prefix of the unique names, to generate again')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-index', action='store_true', help="Don't add the articles to the search index")
+
+    def handle(self, *args, **options):
+        if not options['users'] and (options['articles'] or options['comments']):
+            raise CommandError('Articles and comments need --users')
+        self.rng = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            self.create_oauth_users(options['oauth_users'], users)
+            categories = self.create_categories(options['categories'])
+            tags = self.create_tags(options['tags'])
+            articles = self.create_articles(options['articles'], users, categories, tags)
+            self.create_comments(options['comments'], users, articles)
+            self.reset_sequences()
+        if not options['no_index']:
+            self.update_search_index(articles)
+        # bulk_create sends no post_save
+        flush_cache_namespace()
+        self.stdout.write(self.style.SUCCESS('generated benchmark data, run render_markdown to store the html'))
+
+    def next_id(self, model):
+        return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+    def bulk_create(self, model, objects):
+        created = 0
+        objects = iter(objects)
+        while True:
+            batch = list(itertools.islice(objects, self.batch_size))
+            if not batch:
+                break
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            created += len(batch)
+        self.stdout.write('{model}: {count} created'.format(model=model._meta.verbose_name, count=created))
+
+    def reset_sequences(self):
+        """The ids are set by bulk_create, the sequences of the databases having them must skip them"""
+        models = [get_user_model(), OAuthUser, Category, Tag, Article, Article.tags.through, Comment]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def random_time(self, after=START_TIME):
+        days = (datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc) - after).days or 1
+        return after + datetime.timedelta(days=self.rng.randrange(days), seconds=self.rng.randrange(86400))
+
+    def create_users(self, count):
+        model = get_user_model()
+        first = self.next_id(model)
+        # hashing is slow on purpose, every user gets the same password
+        password = make_password('benchmark')
+        self.bulk_create(model, (model(id=first + i, username='{0}_user_{1}'.format(self.prefix, i),
+                                       email='{0}_user_{1}@example.com'.format(self.prefix, i),
+                                       nickname=sentence(self.rng, 1, 2)[:-1], password=password,
+                                       date_joined=self.random_time(), source='benchmark')
+                                 for i in range(count)))
+        return list(range(first, first + count))
+
+    def create_oauth_users(self, count, users):
+        first = self.next_id(OAuthUser)
+        self.bulk_create(OAuthUser, (OAuthUser(id=first + i, author_id=self.rng.choice(users) if users else None,
+                                               openid='{0:032x}'.format(self.rng.getrandbits(128)),
+                                               nikename='{0}_oauth_{1}'.format(self.prefix, i),
+                                               type=self.rng.choice(OAUTH_TYPES),
+                                               email='{0}_oauth_{1}@example.com'.format(self.prefix, i))
+                                     for i in range(count)))
+
+    def create_categories(self, count):
+        """A few roots and the others under a random earlier category, so the tree is a few levels deep"""
+        first = self.next_id(Category)
+        categories = []
+        objects = []
+        for i in range(count):
+            parent = self.rng.choice(categories) if categories and self.rng.random() < 0.8 else None
+            name = '{0} category {1}'.format(self.prefix, i)
+            objects.append(Category(id=first + i, name=name, slug=slugify(name), parent_category_id=parent))
+            categories.append(first + i)
+        self.bulk_create(Category, objects)
+        return categories
+
+    def create_tags(self, count):
+        first = self.next_id(Tag)
+        self.bulk_create(Tag, (Tag(id=first + i, name='{0} tag {1}'.format(self.prefix, i),
+                                   slug=slugify('{0} tag {1}'.format(self.prefix, i)))
+                               for i in range(count)))
+        return list(range(first, first + count))
+
+    def create_articles(self, count, users, categories, tags):
+        """
+        :return: {article id: pub_time}
+        """
+        first = self.next_id(Article)
+        articles = {}
+        # a few tags are on most of the articles, like on a real blog
+        weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(len(tags))))
+        article_tags = []
+
+        def generate():
+            for i in range(count):
+                pub_time = self.random_time()
+                articles[first + i] = pub_time
+                title = '{0} {1} {2}'.format(self.prefix, sentence(self.rng, 2, 6)[:-1], i)
+                if tags:
+                    for tag in set(self.rng.choices(tags, cum_weights=weights, k=self.rng.randint(1, 5))):
+                        article_tags.append(Article.tags.through(article_id=first + i, tag_id=tag))
+                yield Article(id=first + i, title=title, body=markdown(self.rng), pub_time=pub_time,
+                              created_time=pub_time, last_mod_time=pub_time,
+                              status='p' if self.rng.random() < 0.95 else 'd',
+                              type='a' if self.rng.random() < 0.98 else 'p',
+                              views=int(self.rng.paretovariate(1.2) * 10),
+                              author_id=self.rng.choice(users),
+                              category_id=self.rng.choice(categories) if categories else None,
+                              description=sentence(self.rng))
+
+        self.bulk_create(Article, generate())
+        self.bulk_create(Article.tags.through, article_tags)
+        return articles
+
+    def create_comments(self, count, users, articles):
+        """Mostly on the popular articles, a third of them answer an earlier comment of the article"""
+        first = self.next_id(Comment)
+        ids = list(articles)
+        weights = list(itertools.accumulate(1.0 / (i + 1) ** 0.5 for i in range(len(ids))))
+        recent = {}
+
+        def generate():
+            for i in range(count):
+                article = self.rng.choices(ids, cum_weights=weights)[0]
+                thread = recent.setdefault(article, [])
+                parent = self.rng.choice(thread) if thread and self.rng.random() < 0.33 else None
+                thread.append(first + i)
+                del thread[:-5]
+                created_time = self.random_time(articles[article])
+                yield Comment(id=first + i, body=sentence(self.rng, 3, 30), article_id=article,
+                              parent_comment_id=parent, author_id=self.rng.choice(users), created_time=created_time,
+                              last_mod_time=created_time, is_enabled=self.rng.random() < 0.97)
+
+        if ids:
+            self.bulk_create(Comment, generate())
+
+    def update_search_index(self, articles):
+        """Index the new articles in batches, like update_index does, instead of one save signal per article"""
+        from haystack import connections
+        backend = connections['default'].get_backend()
+        index = connections['default'].get_unified_index().get_index(Article)
+        ids = sorted(articles)
+        indexed = 0
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            queryset = index.index_queryset().filter(id__gte=batch[0], id__lte=batch[-1]) \
+                .select_related('author', 'category').prefetch_related('tags')
+            objects = list(queryset)
+            backend.update(index, objects)
+            indexed += len(objects)
+        self.stdout.write('search index: {count} articles'.format(count=indexed))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from django.core.management.base import BaseCommand
+from blog.models import Article
+from comments.models import Comment
+from DjangoBlog.utils import invalidate_cache_tags
+
+
+class Command(BaseCommand):
+    help = 'Re-render the stored Markdown HTML of articles and comments, e.g. after CommonMarkdown.VERSION changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render rows which are up to date too')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def update(self, model, batch):
+        model.objects.bulk_update(batch, ['body_html', 'body_html_hash'])
+        # bulk_update sends no post_save, the cached values of the rows are invalidated here
+        invalidate_cache_tags(*batch)
+        return len(batch)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Article, Comment):
+            rendered = 0
+            batch = []
+            for obj in model.objects.only('id', 'body', 'body_html_hash').iterator(chunk_size=batch_size):
+                if obj.render_body(force=options['force']):
+                    batch.append(obj)
+                if len(batch) >= batch_size:
+                    rendered += self.update(model, batch)
+                    batch = []
+            if batch:
+                rendered += self.update(model, batch)
+            if rendered:
+                # the lists show the rendered bodies too
+                invalidate_cache_tags(model)
+            self.stdout.write('{model}: {count} rendered'.format(model=model._meta.verbose_name, count=rendered))
+        self.stdout.write(self.style.SUCCESS('finish render markdown'))
@@ -1,10 +1,103 @@
 #!/usr/bin/env python
 
 import datetime
+import random
+import re
+import threading
 import time
 # from ipware.ip import get_real_ip
-from DjangoBlog.utils import cache
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.http import urlencode
+from DjangoBlog.utils import cache, get_md5, get_tagged_cache, set_tagged_cache, get_cache_stats, publish_cache_stats
+from DjangoBlog.utils import start_collecting_cache_tags, stop_collecting_cache_tags
+from DjangoBlog.profiling import StackSampler, is_valid_profile_token, save_profile
+from DjangoBlog.latency import QueryLog, record_latency, check_query_budget
 from blog.documents import ELASTICSEARCH_ENABLED, ElaspedTimeDocumentManager
+from blog.visitors import is_bot
+
+CSRF_TOKEN_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_TOKEN_PLACEHOLDER = b'<!!CSRF_TOKEN!!>'
+# validators set by conditional_page, kept so ConditionalGetMiddleware answers 304 to cached pages too
+PAGE_CACHE_HEADERS = ('ETag', 'Last-Modified')
+LOAD_TIMES_PLACEHOLDER = b'<!!LOAD_TIMES!!>'
+# tracking parameters of the links to the blog, the pages don't depend on them
+PAGE_CACHE_IGNORED_PARAM_RE = re.compile(r'^(utm_\w+|fbclid|gclid|yclid|_openstat)$')
+
+
+class LatencyMiddleware(object):
+    """
+    Record the wall, database and template time of every request in the latency histograms of its url name
+    and log the views over their query budget, it's the first middleware so the wall time covers all the others.
+    The QueryLog of the request is set on the response as queries, tests assert the budgets with it
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        queries = QueryLog()
+        request.template_time = 0.0
+        start_time = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        wall_time = time.perf_counter() - start_time
+        response.queries = queries
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            record_latency(match.view_name, wall=wall_time, db=queries.time, template=request.template_time)
+            check_query_budget(match.view_name, queries)
+        return response
+
+    def process_template_response(self, request, response):
+        # it's called right before the response is rendered
+        start_time = time.perf_counter()
+
+        def rendered(response):
+            request.template_time += time.perf_counter() - start_time
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Sample the stacks of a fraction of the requests, or of the ones with a token of make_profile_token
+    in the X-Profile header or the profile parameter, into the collapsed stack file of their view.
+    Unless PROFILING_ENABLED it isn't in the middleware chain at all
+    """
+
+    def __init__(self, get_response=None):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        if not self.is_profiled(request):
+            return self.get_response(request)
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            save_profile(match.view_name, stacks)
+        return response
+
+    @staticmethod
+    def is_profiled(request):
+        token = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+        if token:
+            return is_valid_profile_token(token)
+        return random.random() < settings.PROFILING_SAMPLE_RATE
 
 
 class OnlineMiddleware(object):
@@ -15,19 +108,96 @@ class OnlineMiddleware(object):
     def __call__(self, request):
         start_time = time.time()
         response = self.get_response(request)
-        http_user_agent = request.META.get('HTTP_USER_AGENT', [])
-        if 'Spider' in http_user_agent or 'spider' in http_user_agent:
-            return response
+        cast_time = time.time() - start_time
+        http_user_agent = request.META.get('HTTP_USER_AGENT', '')
+        if ELASTICSEARCH_ENABLED and not is_bot(http_user_agent):
+            time_taken = round((cast_time) * 1000, 2)
+            ElaspedTimeDocumentManager.create(url=request.path, time_taken=time_taken, log_datetime=timezone.now(),
+                                              type='blog', useragent=http_user_agent)
+        response['Server-Timing'] = 'app;dur={duration:.1f}'.format(duration=cast_time * 1000)
+        # only html pages may show the time, feeds, sitemaps and files are not copied to look for it
+        if not response.streaming and response.get('Content-Type', '').startswith('text/html'):
+            content = response.content
+            if LOAD_TIMES_PLACEHOLDER in content:
+                response.content = content.replace(LOAD_TIMES_PLACEHOLDER, str.encode(str(cast_time)[:5]))
+        return response
+
+
+class PageCacheMiddleware(object):
+    """
+    Whole page cache for anonymous visitors of the views decorated with page_cache.
+    A page is stored with the dependency tags of everything read through the tagged cache while it was rendered,
+    plus the ones added with add_cache_tags, so invalidate_cache_tags purges exactly the pages showing an object
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self.stats = get_cache_stats('page_cache')
+        super().__init__()
+
+    def __call__(self, request):
+        start_time = time.time()
+        start_collecting_cache_tags()
         try:
-            cast_time = time.time() - start_time
-            if ELASTICSEARCH_ENABLED:
-                time_taken = round((cast_time) * 1000, 2)
-                url = request.path
-                from django.utils import timezone
-
-                ElaspedTimeDocumentManager.create(url=url, time_taken=time_taken, log_datetime=timezone.now(),
-                                                  type='blog', useragent=http_user_agent)
-            response.content = response.content.replace(b'<!!LOAD_TIMES!!>', str.encode(str(cast_time)[:5]))
-        except:
-            pass
+            response = self.get_response(request)
+        finally:
+            tags = stop_collecting_cache_tags()
+        key = getattr(request, '_page_cache_key', None)
+        if key and self.is_cacheable_response(request, response):
+            self.stats.compute_time += time.time() - start_time
+            content = CSRF_TOKEN_RE.sub(rb'\1' + CSRF_TOKEN_PLACEHOLDER + rb'\2', response.content)
+            headers = {h: response[h] for h in PAGE_CACHE_HEADERS if response.has_header(h)}
+            set_tagged_cache(key, (content, response['Content-Type'], headers), tags, request._page_cache_timeout,
+                             'pages')
+        publish_cache_stats()
         return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timeout = getattr(view_func, 'page_cache_timeout', None)
+        if timeout is None or not self.is_cacheable_request(request):
+            return None
+        key = self.get_cache_key(request)
+        if key is None:
+            return None
+        hit, value = get_tagged_cache(key, None, 'pages')
+        if not hit:
+            self.stats.misses += 1
+            request._page_cache_key = key
+            request._page_cache_timeout = timeout
+            return None
+        self.stats.hits += 1
+        on_hit = view_func.page_cache_on_hit
+        if on_hit is not None:
+            on_hit(request, *view_args, **view_kwargs)
+        content, content_type, headers = value
+        token = get_token(request).encode()
+        response = HttpResponse(content.replace(CSRF_TOKEN_PLACEHOLDER, token), content_type=content_type)
+        for header, header_value in headers.items():
+            response[header] = header_value
+        return response
+
+    def get_cache_key(self, request):
+        """
+        Key of the page from the parameters in PAGE_CACHE_QUERY_PARAMS, so made up query strings don't fill the cache
+        :return: None for a parameter the page may depend on which is not part of the key, the page isn't cached
+        """
+        params = []
+        for name, values in sorted(request.GET.lists()):
+            if name in settings.PAGE_CACHE_QUERY_PARAMS:
+                params.append((name, values))
+            elif not PAGE_CACHE_IGNORED_PARAM_RE.match(name):
+                return None
+        return 'page_' + get_md5(request.get_host() + request.path + urlencode(params, doseq=True))
+
+    def is_cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return False
+        # pending messages are rendered into the page
+        return not request.COOKIES.get('messages')
+
+    def is_cacheable_response(self, request, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return False
+        if 'private' in response.get('Cache-Control', ''):
+            return False
+        return not getattr(request, '_messages', None) and not request.session.modified
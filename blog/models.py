@@ -1,22 +1,36 @@
 import logging
+import random
 from abc import ABCMeta, abstractmethod, abstractproperty
 
 from django.db import models
+from django.db.models import Count, F
 from django.urls import reverse
 from django.conf import settings
 from uuslug import slugify
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from DjangoBlog.utils import get_current_site
-from DjangoBlog.utils import cache_decorator, cache
+from DjangoBlog.utils import get_current_site, CommonMarkdown
+from DjangoBlog.utils import cache, cache_decorator, cache_tag, get_tagged_cache, set_tagged_cache
 from DjangoBlog.settings import MEDIA_URL
 from DjangoBlog.settings import MEDIA_ROOT
 from django.utils.timezone import now
+from django.utils.safestring import mark_safe
 from mdeditor.fields import MDTextField
 from django.core.files.images import get_image_dimensions
 
 logger = logging.getLogger(__name__)
 
+# views of an article not yet written to the database
+ARTICLE_VIEWS_KEY = 'article_views_{id}'
+# articles counted since the last flush, memcached has no sets: a log of ids numbered by a counter
+ARTICLE_DIRTY_COUNT_KEY = 'article_dirty_count'
+ARTICLE_DIRTY_KEY = 'article_dirty_{n}'
+# number of the first entry not read yet
+ARTICLE_DIRTY_READ_KEY = 'article_dirty_read'
+# an article is logged once until it is flushed, or until the flag expires if its entry was missed
+ARTICLE_DIRTY_MARK_KEY = 'article_dirty_mark_{id}'
+ARTICLE_DIRTY_MARK_TIMEOUT = 60 * 60
+
 LINK_SHOW_TYPE = (
     ('i', 'Home'),
     ('l', 'List'),
@@ -26,21 +40,107 @@ LINK_SHOW_TYPE = (
 )
 
 
+def mark_article_dirty(article_id):
+    """Log an article for the next flush of the views and visitors counted in the cache"""
+    if not cache.add(ARTICLE_DIRTY_MARK_KEY.format(id=article_id), 1, ARTICLE_DIRTY_MARK_TIMEOUT):
+        return
+    cache.add(ARTICLE_DIRTY_COUNT_KEY, 0, None)
+    n = cache.incr(ARTICLE_DIRTY_COUNT_KEY)
+    cache.set(ARTICLE_DIRTY_KEY.format(n=n), article_id, None)
+
+
+def pop_dirty_articles():
+    """
+    :return: ids logged by mark_article_dirty since the last call, those counted again meanwhile are logged again
+    """
+    last = cache.get(ARTICLE_DIRTY_COUNT_KEY) or 0
+    first = cache.get(ARTICLE_DIRTY_READ_KEY) or 1
+    if last < first:
+        return []
+    keys = [ARTICLE_DIRTY_KEY.format(n=n) for n in range(first, last + 1)]
+    # an entry not written yet is skipped, its article is logged again once its flag expires
+    ids = list(dict.fromkeys(cache.get_many(keys).values()))
+    cache.set(ARTICLE_DIRTY_READ_KEY, last + 1, None)
+    cache.delete_many([ARTICLE_DIRTY_MARK_KEY.format(id=i) for i in ids] + keys)
+    return ids
+
+
+class MarkdownBodyModel(models.Model):
+    """Keeps the HTML rendered from the Markdown `body` next to it"""
+    body_html = models.TextField('HTML', blank=True, default='', editable=False)
+    body_html_hash = models.CharField('Хеш HTML', max_length=32, blank=True, default='', editable=False)
+
+    class Meta:
+        abstract = True
+
+    def render_body(self, force=False):
+        """
+        Render body unless body_html was already rendered from it by the current renderer
+        :return: True if body_html changed
+        """
+        body_hash = CommonMarkdown.get_markdown_hash(self.body)
+        if not force and body_hash == self.body_html_hash:
+            return False
+        self.body_html = CommonMarkdown.get_markdown(self.body)
+        self.body_html_hash = body_hash
+        return True
+
+    def get_body_html(self):
+        """Rendered body, rows not re-rendered since the renderer changed fall back to the cache"""
+        if CommonMarkdown.get_markdown_hash(self.body) != self.body_html_hash:
+            return mark_safe(CommonMarkdown.get_cached_markdown(self.body))
+        return mark_safe(self.body_html)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'body' in update_fields:
+            if self.render_body() and update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['body_html', 'body_html_hash']
+        super().save(*args, **kwargs)
+
+
+class CacheListedModel(models.Model):
+    """
+    Saving a row only evicts the values built from the row itself, unless one of cache_list_fields changed:
+    the lists, the sidebar and the navigation showing the model are evicted too
+    """
+    # fields the lists of the model show, filter or are ordered by
+    cache_list_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._cache_list_values = instance.get_cache_list_values()
+        return instance
+
+    def get_cache_list_values(self):
+        # deferred fields are not loaded for the comparison
+        return tuple(self.__dict__.get(self._meta.get_field(f).attname) for f in self.cache_list_fields)
+
+    def cache_list_changed(self):
+        """:return: True unless the row was loaded and none of cache_list_fields changed since, called once saved"""
+        loaded = getattr(self, '_cache_list_values', None)
+        self._cache_list_values = self.get_cache_list_values()
+        return loaded != self._cache_list_values
+
+
 class BaseModel(models.Model):
     id = models.AutoField(primary_key=True)
     created_time = models.DateTimeField('Время создания', default=now)
     last_mod_time = models.DateTimeField('Время изменения', default=now)
 
     def save(self, *args, **kwargs):
-        is_update_views = isinstance(self, Article) and 'update_fields' in kwargs and kwargs['update_fields'] == [
-            'views']
-        if is_update_views:
-            Article.objects.filter(pk=self.pk).update(views=self.views)
-        else:
-            if 'slug' in self.__dict__:
-                slug = getattr(self, 'title') if 'title' in self.__dict__ else getattr(self, 'name')
-                setattr(self, 'slug', slugify(slug))
-            super().save(*args, **kwargs)
+        if self.pk is not None:
+            self.last_mod_time = now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = list(kwargs['update_fields']) + ['last_mod_time']
+        if 'slug' in self.__dict__:
+            slug = getattr(self, 'title') if 'title' in self.__dict__ else getattr(self, 'name')
+            setattr(self, 'slug', slugify(slug))
+        super().save(*args, **kwargs)
 
     def get_full_url(self):
         site = get_current_site().domain
@@ -55,7 +155,7 @@ class BaseModel(models.Model):
         pass
 
 
-class Article(BaseModel):
+class Article(BaseModel, MarkdownBodyModel, CacheListedModel):
     """Article"""
     STATUS_CHOICES = (
         ('d', 'Черновик'),
@@ -76,6 +176,7 @@ class Article(BaseModel):
     comment_status = models.CharField('Статус комментариев', max_length=1, choices=COMMENT_STATUS, default='o')
     type = models.CharField('Тип', max_length=1, choices=TYPE, default='a')
     views = models.PositiveIntegerField('Просмотры', default=0)
+    unique_visitors = models.PositiveIntegerField('Уникальные посетители', default=0, editable=False)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name='Автор', blank=False, null=False, on_delete=models.CASCADE)
     description = models.TextField('Описание', max_length=300, blank=True, null=True, default="")
     article_order = models.IntegerField('Очередность', blank=False, null=False, default=0)
@@ -83,6 +184,8 @@ class Article(BaseModel):
     tags = models.ManyToManyField('Tag', verbose_name='Тег', blank=True)
     image = models.ImageField(verbose_name='Картинга для тега', upload_to = 'editor', default = 'editor/default_image.png')
 
+    cache_list_fields = ('title', 'status', 'type', 'pub_time', 'article_order', 'category', 'author')
+
     def body_to_string(self):
         return self.body
 
@@ -103,7 +206,7 @@ class Article(BaseModel):
             'day': self.created_time.day
         })
 
-    @cache_decorator(60 * 60 * 10)
+    @cache_decorator(60 * 60 * 10, depends_on=('blog.category',), namespace='article')
     def get_category_tree(self):
         tree = self.category.get_category_tree()
         names = list(map(lambda c: (c.name, c.get_absolute_url()), tree))
@@ -114,18 +217,57 @@ class Article(BaseModel):
         super().save(*args, **kwargs)
 
     def viewed(self):
+        Article.count_view(self.id)
         self.views += 1
-        self.save(update_fields=['views'])
+
+    @staticmethod
+    def count_view(article_id):
+        """Count a view in the shared cache, flush_views adds the counts to the database later"""
+        key = ARTICLE_VIEWS_KEY.format(id=article_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, None):
+                cache.incr(key)
+        mark_article_dirty(article_id)
+
+    @staticmethod
+    def flush_views(ids=None, batch_size=500):
+        """
+        Add the views counted by count_view to the database
+        :param ids: articles to flush, those logged by mark_article_dirty by default
+        :return: number of views written
+        """
+        flushed = 0
+        if ids is None:
+            ids = pop_dirty_articles()
+        for start in range(0, len(ids), batch_size):
+            keys = {ARTICLE_VIEWS_KEY.format(id=i): i for i in ids[start:start + batch_size]}
+            for key, views in cache.get_many(list(keys)).items():
+                if not views:
+                    continue
+                # views counted meanwhile stay in the cache for the next flush
+                cache.decr(key, views)
+                try:
+                    Article.objects.filter(pk=keys[key]).update(views=F('views') + views)
+                except Exception:
+                    cache.incr(key, views)
+                    for article_id in ids[start:]:
+                        mark_article_dirty(article_id)
+                    raise
+                flushed += views
+        return flushed
 
     def comment_list(self):
         cache_key = 'article_comments_{id}'.format(id=self.id)
-        value = cache.get(cache_key)
-        if value:
+        # Saving a comment invalidates the row of its article
+        hit, value = get_tagged_cache(cache_key, [cache_tag(self)], 'comments')
+        if hit and value:
             logger.info('get article comments:{id}'.format(id=self.id))
             return value
         else:
             comments = self.comment_set.filter(is_enabled=True)
-            cache.set(cache_key, comments, 60 * 100)
+            set_tagged_cache(cache_key, comments, [cache_tag(self)], 60 * 100, 'comments')
             logger.info('set article comments:{id}'.format(id=self.id))
             return comments
 
@@ -133,17 +275,23 @@ class Article(BaseModel):
         info = (self._meta.app_label, self._meta.model_name)
         return reverse('admin:%s_%s_change' % info, args=(self.pk,))
 
-    @cache_decorator(expiration=60 * 100)
+    @cache_decorator(expiration=60 * 100, depends_on=('blog.article',), namespace='article')
     def next_article(self):
         # Следующая публикация
         return Article.objects.filter(id__gt=self.id, status='p').order_by('id').first()
 
-    @cache_decorator(expiration=60 * 100)
+    @cache_decorator(expiration=60 * 100, depends_on=('blog.article',), namespace='article')
     def prev_article(self):
         # Предыдущая публикация
         return Article.objects.filter(id__lt=self.id, status='p').first()
 
 
+class VisitorSketch(models.Model):
+    """HyperLogLog of the unique visitors of an article, saved by blog.visitors.flush_visitors"""
+    article = models.OneToOneField(Article, primary_key=True, on_delete=models.CASCADE)
+    registers = models.BinaryField()
+
+
 class Category(BaseModel):
     """Article Category"""
     name = models.CharField('Имя', max_length=30, unique=True)
@@ -161,42 +309,78 @@ class Category(BaseModel):
     def __str__(self):
         return self.name
 
-    @cache_decorator(60 * 60 * 10)
     def get_category_tree(self):
         """
-        Recursively get the parent of the catalog
+        The category and its parents up to the root
         :return:
         """
-        categorys = []
+        return get_category_index().get_ancestors(self.id)
 
-        def parse(category):
-            categorys.append(category)
-            if category.parent_category:
-                parse(category.parent_category)
-
-        parse(self)
-        return categorys
-
-    @cache_decorator(60 * 60 * 10)
     def get_sub_categorys(self):
         """
-        Get all subsets of the current catalog
+        The category and all its descendants
         :return:
         """
-        categorys = []
-        all_categorys = Category.objects.all()
-
-        def parse(category):
-            if category not in categorys:
-                categorys.append(category)
-            childs = all_categorys.filter(parent_category=category)
-            for child in childs:
-                if category not in categorys:
-                    categorys.append(child)
-                parse(child)
-
-        parse(self)
-        return categorys
+        return get_category_index().get_descendants(self.id)
+
+
+class CategoryIndex():
+    """
+    The whole category forest with the ancestors and descendants of every node precomputed,
+    the categories it holds are shared by the whole process and must not be modified
+    """
+
+    def __init__(self, categories):
+        self.categories = {c.id: c for c in categories}
+        self.ids_by_slug = {c.slug: c.id for c in categories}
+        children = {c.id: [] for c in categories}
+        for c in categories:
+            if c.parent_category_id in children:
+                children[c.parent_category_id].append(c.id)
+        # ids from the category itself up to its root
+        self.ancestor_ids = {}
+        for c in categories:
+            ids = [c.id]
+            parent_id = c.parent_category_id
+            while parent_id in self.categories and parent_id not in ids:
+                ids.append(parent_id)
+                parent_id = self.categories[parent_id].parent_category_id
+            self.ancestor_ids[c.id] = ids
+        # ids of the category and its whole subtree, depth first
+        self.descendant_ids = {}
+        for c in categories:
+            ids = []
+            seen = set()
+            stack = [c.id]
+            while stack:
+                category_id = stack.pop()
+                if category_id not in seen:
+                    seen.add(category_id)
+                    ids.append(category_id)
+                    stack.extend(reversed(children[category_id]))
+            self.descendant_ids[c.id] = ids
+        self.descendant_id_sets = {i: frozenset(ids) for i, ids in self.descendant_ids.items()}
+
+    def get(self, category_id):
+        return self.categories.get(category_id)
+
+    def get_by_slug(self, slug):
+        return self.categories.get(self.ids_by_slug.get(slug))
+
+    def get_ancestors(self, category_id):
+        return [self.categories[i] for i in self.ancestor_ids.get(category_id, [])]
+
+    def get_descendants(self, category_id):
+        return [self.categories[i] for i in self.descendant_ids.get(category_id, [])]
+
+    def get_descendant_ids(self, category_id):
+        return self.descendant_id_sets.get(category_id, frozenset())
+
+
+@cache_decorator(60 * 60 * 10, depends_on=('blog.category',), namespace='article', key='category_index', local=True)
+def get_category_index():
+    """Category forest loaded by one query, rebuilt when a category changes"""
+    return CategoryIndex(list(Category.objects.all()))
 
 
 class Tag(BaseModel):
@@ -210,9 +394,33 @@ class Tag(BaseModel):
     def get_absolute_url(self):
         return reverse('blog:tag_detail', kwargs={'tag_name': self.slug})
 
-    @cache_decorator(60 * 60 * 10)
     def get_article_count(self):
-        return Article.objects.filter(tags__name=self.name).distinct().count()
+        return Tag.get_article_counts().get(self.id, 0)
+
+    @staticmethod
+    @cache_decorator(60 * 60 * 10, depends_on=('blog.article', 'blog.tag'), namespace='sidebar',
+                     key='tag_article_counts', local=True)
+    def get_article_counts():
+        """:return: {tag id: article count} of the tag cloud, built once per cache generation"""
+        return {tag.id: count for tag, count, size, color in Tag.get_tag_cloud()}
+
+    @staticmethod
+    @cache_decorator(60 * 60 * 10, depends_on=('blog.article', 'blog.tag'), namespace='sidebar', early_refresh=True,
+                     key='tag_cloud', local=True)
+    def get_tag_cloud():
+        """
+        Tags having articles with their article counts, counted by one query
+        :return: [(tag, count, font size, bootstrap color)] shuffled once per cache generation
+        """
+        tags = list(Tag.objects.annotate(article_count=Count('article', distinct=True)))
+        total = sum(t.article_count for t in tags)
+        # font size grows by 5pt for every average number of articles per tag
+        average = total / len(tags) if total else 1
+        cloud = [(t, t.article_count, round(t.article_count / average * 5 + 10, 1),
+                  settings.BOOTSTRAP_COLOR_TYPES[t.id % len(settings.BOOTSTRAP_COLOR_TYPES)])
+                 for t in tags if t.article_count]
+        random.shuffle(cloud)
+        return cloud
 
     class Meta:
         ordering = ['name']
@@ -288,8 +496,3 @@ class BlogSettings(models.Model):
     def clean(self):
         if BlogSettings.objects.exclude(id=self.id).count():
             raise ValidationError(_('Возможна только одна конфигурация'))
-
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        from DjangoBlog.utils import cache
-        cache.clear()
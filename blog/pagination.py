@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import datetime
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
+
+# Article lists are ordered by these fields, the cursor seeks on them instead of counting an OFFSET
+CURSOR_ORDERING = ('-article_order', '-pub_time', '-pk')
+CURSOR_FIELDS = ('article_order', 'pub_time', 'pk')
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(direction, row):
+    """
+    :param direction: CURSOR_NEXT for the rows after row, CURSOR_PREVIOUS for the ones before it
+    :param row: (article_order, pub_time, pk) of the article the page starts after or ends before
+    :return: cursor string for the url, e.g. n0_1600000000000000_42
+    """
+    article_order, pub_time, pk = row
+    if timezone.is_naive(pub_time):
+        pub_time = timezone.make_aware(pub_time)
+    microseconds = (pub_time - EPOCH) // datetime.timedelta(microseconds=1)
+    return '{direction}{article_order}_{pub_time}_{pk}'.format(direction=direction, article_order=article_order,
+                                                               pub_time=microseconds, pk=pk)
+
+
+def decode_cursor(cursor):
+    """
+    :return: (direction, (article_order, pub_time, pk))
+    :raise Http404: for a malformed cursor
+    """
+    try:
+        direction = cursor[0]
+        article_order, microseconds, pk = (int(p) for p in cursor[1:].split('_'))
+        pub_time = EPOCH + datetime.timedelta(microseconds=microseconds)
+    except (IndexError, ValueError, OverflowError):
+        raise Http404('Invalid cursor')
+    if direction not in (CURSOR_NEXT, CURSOR_PREVIOUS):
+        raise Http404('Invalid cursor')
+    return direction, (article_order, pub_time, pk)
+
+
+def get_cursor_page_ids(queryset, cursor, per_page):
+    """
+    Seek one page of articles
+    :param queryset: articles of the list
+    :param cursor: cursor string, None for the first page
+    :param per_page: articles per page
+    :return: (ids, previous cursor, next cursor), the cursors are None on the first and the last page
+    """
+    if cursor is None:
+        direction, rows = CURSOR_NEXT, queryset.order_by(*CURSOR_ORDERING)
+        has_previous = False
+    else:
+        direction, (article_order, pub_time, pk) = decode_cursor(cursor)
+        if direction == CURSOR_NEXT:
+            rows = queryset.filter(Q(article_order__lt=article_order) |
+                                   Q(article_order=article_order, pub_time__lt=pub_time) |
+                                   Q(article_order=article_order, pub_time=pub_time, pk__lt=pk)) \
+                .order_by(*CURSOR_ORDERING)
+        else:
+            rows = queryset.filter(Q(article_order__gt=article_order) |
+                                   Q(article_order=article_order, pub_time__gt=pub_time) |
+                                   Q(article_order=article_order, pub_time=pub_time, pk__gt=pk)) \
+                .order_by(*CURSOR_FIELDS)
+        has_previous = True
+    # one more row tells whether there is a page further in the same direction
+    rows = list(rows.values_list(*CURSOR_FIELDS)[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == CURSOR_PREVIOUS:
+        rows.reverse()
+        has_previous, has_next = has_more, True
+    else:
+        has_next = has_more
+    if not rows:
+        return [], None, None
+    previous_cursor = encode_cursor(CURSOR_PREVIOUS, rows[0]) if has_previous else None
+    next_cursor = encode_cursor(CURSOR_NEXT, rows[-1]) if has_next else None
+    return [r[2] for r in rows], previous_cursor, next_cursor
+
+
+def get_page_cursor(queryset, number, per_page):
+    """
+    Cursor of the page number, lets the old /page/<n>/ urls work in cursor mode
+    :return: cursor string, None for the first page
+    :raise Http404: for a page out of range
+    """
+    if number < 1:
+        raise Http404('Invalid page')
+    if number == 1:
+        return None
+    offset = (number - 1) * per_page
+    rows = list(queryset.order_by(*CURSOR_ORDERING).values_list(*CURSOR_FIELDS)[offset - 1:offset])
+    if not rows:
+        raise Http404('Invalid page')
+    return encode_cursor(CURSOR_NEXT, rows[0])
+
+
+class CursorPage():
+    """Page of a list paginated by cursors, it stands in for the page_obj of the Paginator"""
+
+    def __init__(self, object_list, previous_cursor, next_cursor):
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
@@ -5,15 +5,16 @@ from django.db.models import Q
 from django.conf import settings
 from django.template.defaultfilters import stringfilter
 from django.utils.safestring import mark_safe
-import random
 from django.urls import reverse
 from blog.models import Article, Category, Tag, Links, SideBar
+from blog.pagination import CursorPage
 from django.utils.encoding import force_text
 from django.shortcuts import get_object_or_404
 import hashlib
 import urllib
 from comments.models import Comment
-from DjangoBlog.utils import cache_decorator, cache
+from DjangoBlog.utils import cache_decorator, get_tagged_cache, set_tagged_cache, get_cache_version
+from DjangoBlog.utils import DEFAULT_CACHE_NAMESPACE, SIDEBAR_CACHE_DEPENDENCIES
 from django.contrib.auth import get_user_model
 from oauth.models import OAuthUser
 from DjangoBlog.utils import get_current_site
@@ -44,6 +45,20 @@ def datetimeformat(data):
         return ""
 
 
+@register.simple_tag
+def cache_version(*objs, namespace=DEFAULT_CACHE_NAMESPACE):
+    """Version of a cached fragment built from objs
+        Usage: {% cache_version article 'blog.tag' namespace='article' as version %}
+    """
+    return get_cache_version(*objs, namespace=namespace)
+
+
+@register.simple_tag
+def sidebar_cache_version():
+    """Version of the cached sidebar fragment"""
+    return get_cache_version(*SIDEBAR_CACHE_DEPENDENCIES, namespace='sidebar')
+
+
 @register.filter(is_safe=True)
 @stringfilter
 def custom_markdown(content):
@@ -53,7 +68,7 @@ def custom_markdown(content):
     # return mark_safe(r.text)
 
     from DjangoBlog.utils import CommonMarkdown
-    return mark_safe(CommonMarkdown.get_markdown(content))
+    return mark_safe(CommonMarkdown.get_cached_markdown(content))
 
 
 @register.filter(is_safe=True)
@@ -107,23 +122,21 @@ def load_articletags(article):
     :param article:
     :return:
     """
-    tags = article.tags.all()
+    cloud = {tag.id: (count, color) for tag, count, size, color in Tag.get_tag_cloud()}
     tags_list = []
-    for tag in tags:
-        url = tag.get_absolute_url()
-        count = tag.get_article_count()
-        tags_list.append((
-            url, count, tag, random.choice(settings.BOOTSTRAP_COLOR_TYPES)
-        ))
+    for tag in article.tags.all():
+        count, color = cloud.get(tag.id, (0, settings.BOOTSTRAP_COLOR_TYPES[0]))
+        tags_list.append((tag.get_absolute_url(), count, tag, color))
     return {
         'article_tags_list': tags_list
     }
 
 
 @register.inclusion_tag('blog/tags/sidebar.html')
-def load_sidebar(user, linktype, request):
+def load_sidebar(linktype):
     """
-    Load the sidebar
+    Load the sidebar, it is the same for every visitor and cached once per link type,
+    see load_sidebar_user for the part which depends on the visitor
     :return:
     """
     # logger.info('load sidebar')
@@ -136,24 +149,19 @@ def load_sidebar(user, linktype, request):
     most_read_articles = Article.objects.filter(status='p').order_by('-views')[:blogsetting.sidebar_article_count]
     dates = Article.objects.datetimes('created_time', 'month', order='DESC')
     links = Links.objects.filter(is_enabled=True).filter(Q(show_type=str(linktype)) | Q(show_type='a'))
-    commment_list = Comment.objects.filter(is_enabled=True).order_by('-id')[:blogsetting.sidebar_comment_count]
+    commment_list = Comment.objects.filter(is_enabled=True).select_related('article', 'author') \
+        .only('article', 'author', 'article__title', 'article__created_time', 'author__username') \
+        .order_by('-id')[:blogsetting.sidebar_comment_count]
+    # one comment per article and author
+    seen = set()
     unique_commment_list = []
     for comment in commment_list:
-        if any(c.article.title == comment.article.title for c in unique_commment_list) and any(c.author.username == comment.author.username for c in unique_commment_list):
+        key = (comment.article_id, comment.author_id)
+        if key in seen:
             continue
+        seen.add(key)
         unique_commment_list.append(comment)
-    # Tag cloud calculate font size
-    # Calculate the average value based on the total size (number / average) * step size
-    increment = 5
-    tags = Tag.objects.all()
-    sidebar_tags = None
-    if tags and len(tags) > 0:
-        s = [t for t in [(t, t.get_article_count()) for t in tags] if t[1]]
-        count = sum([t[1] for t in s])
-        dd = 1 if (count == 0 or not len(tags)) else count / len(tags)
-        import random
-        sidebar_tags = list(map(lambda x: (x[0], x[1], (x[1] / dd) * increment + 10), s))
-        random.shuffle(sidebar_tags)
+    sidebar_tags = Tag.get_tag_cloud()
 
     return {
         'recent_articles': recent_articles,
@@ -161,7 +169,6 @@ def load_sidebar(user, linktype, request):
         'most_read_articles': most_read_articles,
         'article_dates': dates,
         'sidebar_comments': unique_commment_list,
-        'user': user,
         'sidabar_links': links,
         'show_google_adsense': blogsetting.show_google_adsense,
         'google_adsense_codes': blogsetting.google_adsense_codes,
@@ -172,10 +179,24 @@ def load_sidebar(user, linktype, request):
         'show_search_bar': blogsetting.show_search_bar,
         'show_menu_bar': blogsetting.show_menu_bar,
         'extra_sidebars': extra_sidebars,
-        'request': request
     }
 
 
+@register.inclusion_tag('blog/tags/sidebar_user.html')
+def load_sidebar_user(user):
+    """
+    Small part of the sidebar which depends on the visitor, rendered on every request
+    :return:
+    """
+    if not user.is_authenticated:
+        return {'user_comments': None}
+    from DjangoBlog.utils import get_blog_setting
+    blogsetting = get_blog_setting()
+    user_comments = Comment.objects.filter(author=user, is_enabled=True).select_related('article') \
+        .order_by('-id')[:blogsetting.sidebar_comment_count]
+    return {'user_comments': user_comments}
+
+
 @register.inclusion_tag('blog/tags/article_meta_info.html')
 def load_article_metas(article, user):
     """
@@ -193,6 +214,8 @@ def load_article_metas(article, user):
 def load_pagination_info(page_obj, page_type, tag_name):
     previous_url = ''
     next_url = ''
+    if isinstance(page_obj, CursorPage):
+        return load_cursor_pagination_info(page_obj, page_type, tag_name)
     if page_type == '':
         if page_obj.has_next():
             next_number = page_obj.next_page_number()
@@ -234,6 +257,30 @@ def load_pagination_info(page_obj, page_type, tag_name):
     }
 
 
+def load_cursor_pagination_info(page_obj, page_type, tag_name):
+    url = ''
+    if page_type == '':
+        url = reverse('blog:index')
+    if page_type == 'Тег':
+        tag = get_object_or_404(Tag, name=tag_name)
+        url = reverse('blog:tag_detail', kwargs={'tag_name': tag.slug})
+    if page_type == 'Категория':
+        category = get_object_or_404(Category, name=tag_name)
+        url = reverse('blog:category_detail', kwargs={'category_name': category.slug})
+    previous_url = ''
+    next_url = ''
+    if url and page_obj.has_next():
+        next_url = '{url}?{query}'.format(url=url, query=urllib.parse.urlencode({'cursor': page_obj.next_cursor}))
+    if url and page_obj.has_previous():
+        previous_url = '{url}?{query}'.format(url=url,
+                                              query=urllib.parse.urlencode({'cursor': page_obj.previous_cursor}))
+    return {
+        'previous_url': previous_url,
+        'next_url': next_url,
+        'page_obj': page_obj
+    }
+
+
 """
 @register.inclusion_tag('nav.html')
 def load_nav_info():
@@ -270,8 +317,9 @@ def load_article_detail(article, isindex, user):
 def gravatar_url(email, size=40):
     """Get gravatar avatar"""
     cachekey = 'gravatat/' + email
-    if cache.get(cachekey):
-        return cache.get(cachekey)
+    hit, value = get_tagged_cache(cachekey, ['oauth.oauthuser'], 'avatar')
+    if hit and value:
+        return value
     else:
         usermodels = OAuthUser.objects.filter(email=email)
         if usermodels:
@@ -284,7 +332,7 @@ def gravatar_url(email, size=40):
 
         url = "https://www.gravatar.com/avatar/%s?%s" % (
             hashlib.md5(email.lower()).hexdigest(), urllib.parse.urlencode({'d': default, 's': str(size)}))
-        cache.set(cachekey, url, 60 * 60 * 10)
+        set_tagged_cache(cachekey, url, ['oauth.oauthuser'], 60 * 60 * 10, 'avatar')
         return url
 
 
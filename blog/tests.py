@@ -1,9 +1,12 @@
 from django.test import Client, RequestFactory, TestCase
-from blog.models import Article, Category, Tag, SideBar, Links
+from blog.models import Article, Category, Tag, SideBar, Links, ARTICLE_VIEWS_KEY, pop_dirty_articles
+from DjangoBlog.utils import cache, flush_cache_namespace, get_cache_stats
 from django.contrib.auth import get_user_model
 from DjangoBlog.utils import get_current_site, get_md5
 from blog.forms import BlogSearchForm
 from django.core.paginator import Paginator
+from blog.visitors import HyperLogLog, RotatingBloomFilter, forget_visitors, count_visit, publish_visitors, \
+    VISITORS_KEY
 from blog.templatetags.blog_tags import load_pagination_info, load_articletags
 import datetime
 from accounts.models import BlogUser
@@ -11,6 +14,7 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from django.urls import reverse
 import os
+from django.db.models import Max
 
 
 # Create your tests here.
@@ -20,6 +24,24 @@ class ArticleTest(TestCase):
         self.client = Client()
         self.factory = RequestFactory()
 
+    def create_articles(self, name, count=None, **fields):
+        """
+        Published posts by the user name, in the category name
+        :param count: number of articles titled name0, name1..., one article titled name by default
+        :param fields: other fields of the articles, title of the single article too
+        :return: (user, category, articles)
+        """
+        user = BlogUser.objects.get_or_create(email=name + "@gmail.com", username=name)[0]
+        category = Category.objects.get_or_create(name=name)[0]
+        titles = [fields.pop('title', name)] if count is None else [name + str(i) for i in range(count)]
+        fields = dict({'body': name, 'author': user, 'category': category, 'type': 'a', 'status': 'p'}, **fields)
+        articles = []
+        for title in titles:
+            article = Article(title=title, **fields)
+            article.save()
+            articles.append(article)
+        return user, category, articles
+
     def test_validate_article(self):
         site = get_current_site().domain
         user = BlogUser.objects.get_or_create(email="liangliangyy@gmail.com", username="liangliangyy")[0]
@@ -58,6 +80,11 @@ class ArticleTest(TestCase):
 
         article.save()
         self.assertEqual(0, article.tags.count())
+        self.assertEqual(article.body_html.strip(), '<p>nicecontent</p>')
+        Article.objects.filter(pk=article.pk).update(body_html_hash='')
+        from django.core.management import call_command
+        call_command('render_markdown')
+        self.assertTrue(Article.objects.get(pk=article.pk).body_html_hash)
         article.tags.add(tag)
         article.save()
         self.assertEqual(1, article.tags.count())
@@ -182,3 +209,415 @@ class ArticleTest(TestCase):
     def test_errorpage(self):
         rsp = self.client.get('/eee')
         self.assertEqual(rsp.status_code, 404)
+
+    def test_page_cache(self):
+        user, category, [article] = self.create_articles('pagecache', title='pagecachetitle')
+        # ids are reused between tests, drop the views counted by the previous ones
+        cache.delete(ARTICLE_VIEWS_KEY.format(id=article.id))
+        forget_visitors(article.id)
+
+        stats = get_cache_stats('page_cache')
+        hits = stats.hits
+        response = self.client.get(article.get_absolute_url(), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertContains(response, 'pagecachetitle')
+        response = self.client.get(article.get_absolute_url(), HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR='10.0.0.2')
+        self.assertContains(response, 'pagecachetitle')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertNotContains(response, 'CSRF_TOKEN')
+        self.assertEqual(stats.hits, hits + 1)
+        Article.flush_views()
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 2)
+
+        article.title = "pagecachechanged"
+        article.save()
+        response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, 'pagecachechanged')
+        self.assertEqual(stats.hits, hits + 1)
+
+        # tracking parameters share the page, the other ones are not cached
+        url = category.get_absolute_url()
+        self.client.get(url)
+        self.client.get(url + '?utm_source=feed&utm_medium=rss')
+        self.assertEqual(stats.hits, hits + 2)
+        misses = stats.misses
+        self.client.get(url + '?ref=random')
+        self.client.get(url + '?ref=random')
+        self.assertEqual((stats.hits, stats.misses), (hits + 2, misses))
+
+    def test_conditional_get(self):
+        user, category, [article] = self.create_articles('conditional')
+
+        for url in [article.get_absolute_url(), category.get_absolute_url(), '/feed/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(article.get_absolute_url())
+        etag = response['ETag']
+        article.body = "conditionalchanged"
+        article.save()
+        response = self.client.get(article.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # a new sidebar is a new page
+        etag = self.client.get(category.get_absolute_url())['ETag']
+        flush_cache_namespace('sidebar')
+        response = self.client.get(category.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_sidebar(self):
+        from blog.templatetags.blog_tags import load_sidebar, load_sidebar_user
+        from django.contrib.auth.models import AnonymousUser
+        user = BlogUser.objects.get_or_create(email="sidebar@gmail.com", username="sidebar")[0]
+        # the shared part must not depend on the visitor
+        self.assertNotIn('user', load_sidebar('i'))
+        self.assertNotIn('request', load_sidebar('i'))
+        self.assertIsNone(load_sidebar_user(AnonymousUser())['user_comments'])
+        self.assertEqual(len(load_sidebar_user(user)['user_comments']), 0)
+
+    def test_tag_cloud(self):
+        tags = []
+        for name in ['cloud1', 'cloud2', 'cloud3']:
+            tag = Tag()
+            tag.name = name
+            tag.save()
+            tags.append(tag)
+        user, category, articles = self.create_articles('tagcloud', 3)
+        for i, article in enumerate(articles):
+            article.tags.add(*tags[:i + 1])
+
+        cloud = Tag.get_tag_cloud()
+        self.assertEqual(sorted((t.name, c) for t, c, s, color in cloud),
+                         [('cloud1', 3), ('cloud2', 2), ('cloud3', 1)])
+        self.assertEqual(cloud, Tag.get_tag_cloud())
+        self.assertEqual(tags[1].get_article_count(), 2)
+        self.assertEqual([c for u, c, t, color in load_articletags(article)['article_tags_list']], [3, 2, 1])
+
+    def test_sidebar_comments(self):
+        from blog.templatetags.blog_tags import load_sidebar
+        from comments.models import Comment
+        user, category, [article] = self.create_articles('sidebarcomments')
+        for i in range(3):
+            comment = Comment(body='comment' + str(i), author=user, article=article)
+            comment.save()
+
+        comments = list(Comment.objects.filter(is_enabled=True).order_by('-id'))
+        # blog settings and the tag cloud come from the cache afterwards
+        load_sidebar('i')
+        with self.assertNumQueries(1):
+            sidebar_comments = load_sidebar('i')['sidebar_comments']
+            self.assertEqual(sidebar_comments, comments[:1])
+            self.assertEqual(sidebar_comments[0].article.title, 'sidebarcomments')
+            self.assertEqual(sidebar_comments[0].author.username, 'sidebarcomments')
+
+    def test_list_page_cache(self):
+        self.create_articles('listpage', settings.PAGINATE_BY + 1)
+
+        from blog.views import CachedPageList
+        response = self.client.get('/')
+        self.assertEqual(len(response.context['article_list']), settings.PAGINATE_BY)
+        self.assertEqual(response.context['paginator'].count, settings.PAGINATE_BY + 1)
+        self.assertIsInstance(response.context['view'].object_list, CachedPageList)
+        response = self.client.get(reverse('blog:index_page', kwargs={'page': 2}))
+        self.assertEqual([a.title for a in response.context['article_list']], ['listpage0'])
+        response = self.client.get(reverse('blog:index_page', kwargs={'page': 3}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('blog:archives'))
+        self.assertEqual(len(response.context['article_list']), settings.PAGINATE_BY + 1)
+        # the ids of an unpaginated list aren't cached
+        self.assertNotIsInstance(response.context['view'].object_list, CachedPageList)
+
+    def test_cursor_pagination(self):
+        from django.test import override_settings
+        self.create_articles('cursor', settings.PAGINATE_BY + 2)
+
+        with override_settings(CURSOR_PAGINATION=True):
+            response = self.client.get('/')
+            first_page = [a.title for a in response.context['article_list']]
+            self.assertEqual(len(first_page), settings.PAGINATE_BY)
+            page_obj = response.context['page_obj']
+            self.assertFalse(page_obj.has_previous())
+            s = load_pagination_info(page_obj, '', '')
+            response = self.client.get(s['next_url'])
+            self.assertEqual([a.title for a in response.context['article_list']], ['cursor1', 'cursor0'])
+            self.assertFalse(response.context['page_obj'].has_next())
+            s = load_pagination_info(response.context['page_obj'], '', '')
+            response = self.client.get(s['previous_url'])
+            self.assertEqual([a.title for a in response.context['article_list']], first_page)
+            response = self.client.get(reverse('blog:index_page', kwargs={'page': 2}))
+            self.assertEqual([a.title for a in response.context['article_list']], ['cursor1', 'cursor0'])
+            response = self.client.get(reverse('blog:index_page', kwargs={'page': 3}))
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get('/?cursor=bad')
+            self.assertEqual(response.status_code, 404)
+
+    def test_category_index(self):
+        root = Category.objects.create(name='indexroot')
+        child = Category.objects.create(name='indexchild', parent_category=root)
+        grandchild = Category.objects.create(name='indexgrandchild', parent_category=child)
+        other = Category.objects.create(name='indexother')
+
+        self.assertEqual(grandchild.get_category_tree(), [grandchild, child, root])
+        self.assertEqual(root.get_sub_categorys(), [root, child, grandchild])
+        self.assertEqual(other.get_sub_categorys(), [other])
+        with self.assertNumQueries(0):
+            child.get_sub_categorys()
+
+        moved = Category.objects.get(pk=grandchild.pk)
+        moved.parent_category = other
+        moved.save()
+        self.assertEqual(root.get_sub_categorys(), [root, child])
+        self.assertEqual(other.get_sub_categorys(), [other, moved])
+
+    def test_article_views(self):
+        from django.core.management import call_command
+        user, category, [article] = self.create_articles('views')
+        cache.delete(ARTICLE_VIEWS_KEY.format(id=article.id))
+        # the articles counted by the previous tests
+        pop_dirty_articles()
+
+        with self.assertNumQueries(0):
+            article.viewed()
+            Article.count_view(article.id)
+            Article.count_view(article.id)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 0)
+        self.assertEqual(Article.flush_views(), 3)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 3)
+        self.assertEqual(Article.flush_views(), 0)
+        Article.count_view(article.id)
+        call_command('flush_article_views')
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 4)
+
+    def test_unique_visitors(self):
+        unique = HyperLogLog()
+        for i in range(5000):
+            unique.add('visitor{i}'.format(i=i))
+        self.assertAlmostEqual(unique.count(), 5000, delta=500)
+        other = HyperLogLog()
+        for i in range(2500, 7500):
+            other.add('visitor{i}'.format(i=i))
+        unique.merge(other)
+        unique.merge(other)
+        self.assertAlmostEqual(unique.count(), 7500, delta=750)
+
+        seen = RotatingBloomFilter()
+        seen.add('visitor', 1)
+        self.assertIn('visitor', seen)
+        seen.rotate(2)
+        self.assertIn('visitor', seen)
+        seen.rotate(3)
+        self.assertNotIn('visitor', seen)
+
+        from django.core.management import call_command
+        user, category, [article] = self.create_articles('visitors')
+        cache.delete(ARTICLE_VIEWS_KEY.format(id=article.id))
+        forget_visitors(article.id)
+
+        url = article.get_absolute_url()
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR='10.0.0.1')
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR='10.0.0.1')
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR='10.0.0.2')
+        self.client.get(url, HTTP_USER_AGENT='Googlebot/2.1', REMOTE_ADDR='10.0.0.3')
+        self.client.get(url, REMOTE_ADDR='10.0.0.4')
+        publish_visitors(force=True)
+        call_command('flush_article_views')
+        article = Article.objects.get(pk=article.pk)
+        self.assertEqual(article.views, 2)
+        self.assertEqual(article.unique_visitors, 2)
+
+        # the saved sketch keeps the visitors when the cache is emptied
+        cache.delete(VISITORS_KEY.format(id=article.id))
+        forget_visitors(article.id)
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR='10.0.0.5')
+        publish_visitors(force=True)
+        call_command('flush_article_views')
+        self.assertEqual(Article.objects.get(pk=article.pk).unique_visitors, 3)
+
+        # a false positive of the Bloom filters drops a view, never a unique visitor
+        cache.delete(ARTICLE_VIEWS_KEY.format(id=article.id))
+        for i in range(settings.VISITORS_PER_WINDOW):
+            if count_visit(article.id, 'visitor{i}'.format(i=i)):
+                Article.count_view(article.id)
+        publish_visitors(force=True)
+        call_command('flush_article_views')
+        article = Article.objects.get(pk=article.pk)
+        count = settings.VISITORS_PER_WINDOW
+        self.assertAlmostEqual(article.views, 3 + count, delta=count * settings.VISITORS_FALSE_POSITIVE_RATE * 3)
+        self.assertAlmostEqual(article.unique_visitors, 3 + count, delta=count * 0.1)
+
+    def test_elapsed_time_shipper(self):
+        from blog.documents import ElapsedTimeShipper, ElapsedTimeDocument
+        shipped = []
+        shipper = ElapsedTimeShipper(queue_size=5, batch_size=3, flush_interval=0.01)
+        shipper.ship = shipped.extend
+        for i in range(20):
+            shipper.put(ElapsedTimeDocument(meta={'id': i}, url='/{i}'.format(i=i)))
+        shipper.queue.join()
+        self.assertEqual(len(shipped) + shipper.dropped, 20)
+        self.assertEqual(len({doc.meta.id for doc in shipped}), len(shipped))
+
+    def test_article_bulk_index(self):
+        from unittest import mock
+        from blog.documents import ArticleDocumentManager
+        user, category, articles = self.create_articles('bulkindex', 7)
+        for i, article in enumerate(articles):
+            tag = Tag()
+            tag.name = "bulkindex" + str(i)
+            tag.save()
+            article.tags.add(tag)
+        manager = ArticleDocumentManager()
+        articles = Article.objects.filter(title__startswith='bulkindex')
+
+        # an article query and a tag query per chunk of 3, and the empty chunk
+        with self.assertNumQueries(3 * 2 + 1):
+            docs = [manager.convert_article(a) for a in manager.iter_articles(articles, chunk_size=3)]
+        self.assertEqual([d.title for d in docs], ['bulkindex' + str(i) for i in range(7)])
+        self.assertEqual([t['name'] for t in docs[6].tags], ['bulkindex6'])
+        self.assertEqual(docs[0].category['name'], 'bulkindex')
+        # a list is loaded first, then its authors, categories and tags by chunk
+        with self.assertNumQueries(1 + 3 * 3):
+            list(manager.iter_articles(list(Article.objects.filter(title__startswith='bulkindex')), chunk_size=3))
+
+        def streaming_bulk(client, actions, chunk_size, raise_on_error):
+            for action in actions:
+                yield action['_id'] != articles[0].id, action
+
+        progress = []
+        with mock.patch('elasticsearch.helpers.streaming_bulk', streaming_bulk), \
+                mock.patch('blog.documents.connections.get_connection'):
+            result = manager.bulk_index(articles, chunk_size=3, thread_count=1, progress=progress.append)
+        self.assertEqual(result, (6, 1))
+        self.assertEqual(progress, [3, 6, 7])
+
+        # the article of a save is sent without a pool of threads
+        with mock.patch('elasticsearch.helpers.streaming_bulk', streaming_bulk), \
+                mock.patch('elasticsearch.helpers.parallel_bulk') as parallel_bulk, \
+                mock.patch('blog.documents.connections.get_connection'):
+            result = manager.bulk_index([articles[1]], thread_count=2)
+        self.assertEqual(result, (1, 0))
+        parallel_bulk.assert_not_called()
+
+    def test_load_times(self):
+        from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+        from blog.middleware import OnlineMiddleware
+        request = self.factory.get('/')
+        response = OnlineMiddleware(lambda r: HttpResponse('<p><!!LOAD_TIMES!!></p>'))(request)
+        self.assertNotContains(response, '<!!LOAD_TIMES!!>')
+        self.assertTrue(response['Server-Timing'].startswith('app;dur='))
+        response = OnlineMiddleware(lambda r: JsonResponse({'a': '<!!LOAD_TIMES!!>'}))(request)
+        self.assertContains(response, '<!!LOAD_TIMES!!>')
+        response = OnlineMiddleware(lambda r: StreamingHttpResponse(iter([b'<!!LOAD_TIMES!!>'])))(request)
+        self.assertEqual(b''.join(response.streaming_content), b'<!!LOAD_TIMES!!>')
+        self.assertIn('Server-Timing', response)
+
+    def test_query_budget(self):
+        from django.db import connection
+        from DjangoBlog.latency import QueryLog, check_query_budget
+        from comments.models import Comment
+        user, category, articles = self.create_articles('budget', settings.PAGINATE_BY + 1)
+        for i, article in enumerate(articles):
+            tag = Tag()
+            tag.name = "budget" + str(i)
+            tag.save()
+            article.tags.add(tag)
+            comment = Comment(article=article, author=user, body="budget" + str(i))
+            comment.save()
+
+        cache.clear()
+        for url in ('/', article.get_absolute_url(), category.get_absolute_url(), tag.get_absolute_url(),
+                    reverse('blog:archives')):
+            response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(check_query_budget(response.resolver_match.view_name, response.queries), [])
+
+        queries = QueryLog()
+        with connection.execute_wrapper(queries):
+            for a in Article.objects.all():
+                list(a.tags.all())
+        self.assertEqual(queries.repeated()[0][1], settings.PAGINATE_BY + 1)
+        self.assertTrue(check_query_budget('blog:index', queries))
+
+    def test_generate_benchdata(self):
+        from django.core.management import call_command
+        from comments.models import Comment
+        from haystack.query import SearchQuerySet
+        call_command('generate_benchdata', articles=30, categories=5, tags=10, comments=100, users=5,
+                     oauth_users=3, seed=1, prefix='first', batch_size=7)
+        self.assertEqual(Article.objects.filter(title__startswith='first').count(), 30)
+        self.assertEqual(Comment.objects.filter(article__title__startswith='first').count(), 100)
+        self.assertTrue(Comment.objects.filter(parent_comment__isnull=False).exists())
+        self.assertTrue(Category.objects.filter(name__startswith='first', parent_category__isnull=False).exists())
+        self.assertTrue(Article.tags.through.objects.filter(article__title__startswith='first').exists())
+        self.assertTrue(SearchQuerySet().filter(content=Article.objects.filter(status='p').last().title).count())
+        # new rows get ids after the generated ones
+        user = BlogUser.objects.create(username='afterbench', email='afterbench@example.com')
+        self.assertGreater(user.id, BlogUser.objects.filter(username__startswith='first').aggregate(
+            m=Max('id'))['m'])
+
+        call_command('generate_benchdata', articles=30, categories=5, tags=10, comments=100, users=5,
+                     oauth_users=3, seed=1, prefix='second', batch_size=7, no_index=True)
+        bodies = [list(Article.objects.filter(title__startswith=p).order_by('id').values_list('body', flat=True))
+                  for p in ('first', 'second')]
+        self.assertEqual(bodies[0], bodies[1])
+
+    def test_benchmark(self):
+        import json
+        import tempfile
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        from comments.models import Comment
+        # the comments posted by the benchmark are by the user benchmark
+        user, category, articles = self.create_articles('benchmarkauthor', settings.PAGINATE_BY * 2)
+        article = articles[-1]
+        Comment(article=article, author=user, body="benchmark").save()
+        comments = Comment.objects.count()
+        with tempfile.NamedTemporaryFile('w+', suffix='.json') as baseline:
+            out = StringIO()
+            call_command('benchmark', requests=3, warmup=1, write=True, save_baseline=baseline.name, stdout=out)
+            self.assertIn('index_last', out.getvalue())
+            self.assertEqual(Comment.objects.count(), comments)
+            results = json.load(baseline)
+            self.assertEqual(results['article']['status'], [200])
+            self.assertEqual(results['comment_post']['status'], [302])
+            self.assertIsNotNone(results['index']['cache_hit_rate'])
+            hits = get_cache_stats('page_cache').hits
+            call_command('benchmark', requests=3, warmup=1, no_page_cache=True, stdout=StringIO())
+            self.assertEqual(get_cache_stats('page_cache').hits, hits)
+
+            for result in results.values():
+                result['queries'] = result['queries'] / 2.0
+                result['rps'] = result['rps'] * 10
+            baseline.seek(0)
+            baseline.truncate()
+            json.dump(results, baseline)
+            baseline.flush()
+            with self.assertRaisesRegex(CommandError, 'index rps'):
+                call_command('benchmark', requests=3, warmup=1, baseline=baseline.name, stdout=StringIO())
+
+    def test_benchmark_tags(self):
+        import json
+        import tempfile
+        from django.core.management import call_command
+        from io import StringIO
+        from comments.models import Comment
+        user, category, articles = self.create_articles('benchmarktags', 25)
+        article = articles[-1]
+        parent = None
+        for i in range(5):
+            parent = Comment.objects.create(article=article, author=user, body="benchmarktags",
+                                            parent_comment=parent)
+
+        with tempfile.NamedTemporaryFile('w+', suffix='.json') as baseline:
+            out = StringIO()
+            call_command('benchmark_tags', count=3, sizes='2,4', save_baseline=baseline.name, stdout=out,
+                         only='truncatechars_content,gravatar_url,load_sidebar,load_pagination_info,parse_commenttree')
+            results = json.load(baseline)
+        self.assertEqual(results['gravatar_url[4]/warm']['queries'], 0)
+        self.assertGreater(results['gravatar_url[4]/cold']['queries'], 0)
+        self.assertGreater(results['load_sidebar[i]/cold']['ns_per_op'], 0)
+        self.assertIn('load_pagination_info[category]/warm', results)
+        self.assertEqual(results['parse_commenttree[5]/warm']['queries'], 5)
@@ -1,30 +1,31 @@
 #!/usr/bin/env python
 
 from django.urls import path
-from django.views.decorators.cache import cache_page
+from DjangoBlog.utils import page_cache
 from . import views
 
 app_name = "blog"
 urlpatterns = [
-    path(r'', views.IndexView.as_view(), name='index'),
-    path(r'page/<int:page>/', views.IndexView.as_view(), name='index_page'),
+    path(r'', page_cache()(views.IndexView.as_view()), name='index'),
+    path(r'page/<int:page>/', page_cache()(views.IndexView.as_view()), name='index_page'),
 
     path(r'article/<int:year>/<int:month>/<int:day>/<int:article_id>.html',
-         views.ArticleDetailView.as_view(),
+         page_cache(on_hit=views.article_viewed)(views.ArticleDetailView.as_view()),
          name='detailbyid'),
 
-   path(r'category/<slug:category_name>.html', views.CategoryDetailView.as_view(), name='category_detail'),
-   path(r'category/<slug:category_name>/<int:page>.html', views.CategoryDetailView.as_view(),
+   path(r'category/<slug:category_name>.html', page_cache()(views.CategoryDetailView.as_view()),
+        name='category_detail'),
+   path(r'category/<slug:category_name>/<int:page>.html', page_cache()(views.CategoryDetailView.as_view()),
         name='category_detail_page'),
 
-    path(r'author/<author_name>.html', views.AuthorDetailView.as_view(), name='author_detail'),
-    path(r'author/<author_name>/<int:page>.html', views.AuthorDetailView.as_view(),
+    path(r'author/<author_name>.html', page_cache()(views.AuthorDetailView.as_view()), name='author_detail'),
+    path(r'author/<author_name>/<int:page>.html', page_cache()(views.AuthorDetailView.as_view()),
          name='author_detail_page'),
 
-    path(r'tag/<slug:tag_name>.html', views.TagDetailView.as_view(), name='tag_detail'),
-    path(r'tag/<slug:tag_name>/<int:page>.html', views.TagDetailView.as_view(), name='tag_detail_page'),
-    path('archives.html', cache_page(60 * 60)(views.ArchivesView.as_view()), name='archives'),
-    path('links.html', views.LinkListView.as_view(), name='links'),
+    path(r'tag/<slug:tag_name>.html', page_cache()(views.TagDetailView.as_view()), name='tag_detail'),
+    path(r'tag/<slug:tag_name>/<int:page>.html', page_cache()(views.TagDetailView.as_view()), name='tag_detail_page'),
+    path('archives.html', page_cache()(views.ArchivesView.as_view()), name='archives'),
+    path('links.html', page_cache()(views.LinkListView.as_view()), name='links'),
     path(r'upload', views.fileupload, name='upload'),
     path(r'refresh', views.refresh_memcache, name='refresh')
 
@@ -7,12 +7,19 @@ from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
 from django.conf import settings
 from django import forms
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden, HttpRequest
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden, HttpResponseBadRequest, HttpRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from DjangoBlog.utils import cache, get_md5, get_blog_setting
+from DjangoBlog.utils import get_md5, get_blog_setting, get_or_set_tagged_cache
+from DjangoBlog.utils import CACHE_NAMESPACES, flush_cache_namespace, add_cache_tags
+from DjangoBlog.utils import conditional_page, SIDEBAR_CACHE_DEPENDENCIES
+from django.db.models import Max
 from django.shortcuts import get_object_or_404
-from blog.models import Article, Category, Tag, Links
+from django.core.paginator import InvalidPage
+from blog.pagination import CursorPage, get_cursor_page_ids, get_page_cursor, decode_cursor, encode_cursor
+from blog.models import Article, Category, Tag, Links, get_category_index
+from blog.visitors import get_visitor, count_visit
+from blog.templatetags.blog_tags import sidebar_cache_version
 from comments.forms import CommentForm
 import logging
 from django.core.files.images import get_image_dimensions
@@ -20,7 +27,58 @@ from django.http import Http404
 logger = logging.getLogger(__name__)
 
 
-class ArticleListView(ListView):
+class ConditionalGetMixin():
+    """
+    Answer revalidation requests with 304 before the page is rendered, see conditional_page
+    """
+    # models the sidebar, the navigation and the article meta of the page are built from
+    page_depends_on = SIDEBAR_CACHE_DEPENDENCIES + ('accounts.bloguser',)
+
+    def get_last_modified(self):
+        """
+        Subclass override. Latest modification time of the rows the page shows
+        """
+        raise NotImplementedError()
+
+    def get(self, request, *args, **kwargs):
+        get = conditional_page(lambda request, *args, **kwargs: self.get_last_modified(), self.page_depends_on,
+                               lambda request: sidebar_cache_version())(super(ConditionalGetMixin, self).get)
+        return get(request, *args, **kwargs)
+
+
+def load_articles(ids):
+    """Articles of the ids in the same order, by one query plus one for their tags"""
+    articles = Article.objects.select_related('author', 'category').prefetch_related('tags').in_bulk(ids)
+    return [articles[i] for i in ids if i in articles]
+
+
+class CachedPageList():
+    """
+    Stands in for the queryset of a list view: the total count and the ids of the requested page come
+    from the cache, only the rows of that page are loaded, by one pk__in query
+    """
+
+    def __init__(self, count, offset, ids):
+        self._count = count
+        self.offset = offset
+        self.ids = ids
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self[self.offset:self.offset + len(self.ids)])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.start != self.offset:
+            raise IndexError('Only the cached page starting at {offset} is available'.format(offset=self.offset))
+        return load_articles(self.ids[:index.stop - index.start])
+
+
+class ArticleListView(ConditionalGetMixin, ListView):
     # template_name Property to specify which template to use for rendering
     template_name = 'blog/article_index.html'
 
@@ -55,30 +113,91 @@ class ArticleListView(ListView):
         """
         raise NotImplementedError()
 
+    def get_queryset_cache_tags(self):
+        """
+        Subclass extend. Models the cached page is built from
+        """
+        return [Article]
+
+    def get_page_ids(self):
+        '''
+        Ids of the articles of the requested page
+        :return: (total count, offset of the page, ids)
+        '''
+        queryset = self.get_queryset_data()
+        paginator = self.get_paginator(queryset, self.paginate_by)
+        try:
+            number = paginator.num_pages if self.page_number == 'last' else paginator.validate_number(self.page_number)
+        except InvalidPage:
+            # the paginator of the view raises 404 for it
+            return paginator.count, 0, []
+        offset = (number - 1) * paginator.per_page
+        return paginator.count, offset, list(queryset.values_list('pk', flat=True)[offset:offset + paginator.per_page])
+
     def get_queryset_from_cache(self, cache_key):
         '''
-        Cache page data
+        Cache page data, only the ids of the page and the total count are stored
         :param cache_key: Cache key
-        :return:
+        :return: CachedPageList
         '''
-        value = cache.get(cache_key)
-        if value:
-            # logger.debug('get view cache.key:{key}'.format(key=cache_key))
-            return value
+        tags = self.get_queryset_cache_tags()
+        # only one worker rebuilds an expired page, the others get the previous one meanwhile
+        count, offset, ids = get_or_set_tagged_cache(cache_key, self.get_page_ids, tags, namespace='lists')
+        return CachedPageList(count, offset, ids)
+
+    def get_cursor_page(self):
+        '''
+        Page of the cursor in the request or, without one, of the page number, see settings.CURSOR_PAGINATION
+        :return: CursorPage
+        '''
+        key = self.get_queryset_cache_key()
+        tags = self.get_queryset_cache_tags()
+        cursor = self.request.GET.get('cursor')
+        if cursor is None:
+            try:
+                number = int(self.page_number)
+            except ValueError:
+                raise Http404('Invalid page')
+            # page number to cursor map, keeps the /page/<n>/ urls working
+            cursor = get_or_set_tagged_cache(
+                key + '_cursor', lambda: get_page_cursor(self.get_queryset_data(), number, self.paginate_by),
+                tags, namespace='lists')
         else:
-            article_list = self.get_queryset_data()
-            cache.set(cache_key, article_list)
-            # logger.debug('set view cache.key:{key}'.format(key=cache_key))
-            return article_list
+            cursor = encode_cursor(*decode_cursor(cursor))
+        ids, previous_cursor, next_cursor = get_or_set_tagged_cache(
+            '{key}_{cursor}'.format(key=key, cursor=cursor),
+            lambda: get_cursor_page_ids(self.get_queryset_data(), cursor, self.paginate_by), tags, namespace='lists')
+        return CursorPage(load_articles(ids), previous_cursor, next_cursor)
 
     def get_queryset(self):
         '''
         Override default to get data from cache
         :return:
         '''
-        key = self.get_queryset_cache_key()
-        value = self.get_queryset_from_cache(key)
-        return value
+        # get_last_modified reads the page before ListView does
+        if not hasattr(self, '_page_queryset'):
+            if not self.paginate_by:
+                # a list of every article, its ids could outgrow a cache value, the page itself is cached
+                self._page_queryset = self.get_queryset_data()
+            elif settings.CURSOR_PAGINATION:
+                self._page_queryset = self.get_cursor_page()
+            else:
+                self._page_queryset = self.get_queryset_from_cache(self.get_queryset_cache_key())
+        return self._page_queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        if isinstance(queryset, CursorPage):
+            return None, queryset, queryset.object_list, queryset.has_other_pages()
+        return super(ArticleListView, self).paginate_queryset(queryset, page_size)
+
+    def get_last_modified(self):
+        # only the rows of the requested page, their ids come from the cached page
+        if not self.paginate_by:
+            return self.get_queryset_data().aggregate(last_mod_time=Max('last_mod_time'))['last_mod_time']
+        page = self.get_queryset()
+        if isinstance(page, CursorPage):
+            return max((article.last_mod_time for article in page.object_list), default=None)
+        return Article.objects.filter(pk__in=page.ids).aggregate(last_mod_time=Max('last_mod_time'))['last_mod_time']
 
     def get_context_data(self, **kwargs):
         kwargs['linktype'] = self.link_type
@@ -110,7 +229,7 @@ class IndexView(ArticleListView):
         # return super(ArticleListView, self).get_context_data(**kwargs)
 
 
-class ArticleDetailView(DetailView):
+class ArticleDetailView(ConditionalGetMixin, DetailView):
     '''
     Article details page
     '''
@@ -119,6 +238,8 @@ class ArticleDetailView(DetailView):
         self.page = 'article_details'
     template_name = 'blog/article_detail.html'
     model = Article
+    # the page shows the tags four times
+    queryset = Article.objects.select_related('author', 'category').prefetch_related('tags')
     pk_url_kwarg = 'article_id'
     context_object_name = "article"
 
@@ -126,10 +247,17 @@ class ArticleDetailView(DetailView):
         obj = super(ArticleDetailView, self).get_object()
         if obj.status == 'd':
             raise Http404()
-        obj.viewed()
+        if article_viewed(self.request, obj.id):
+            obj.views += 1
+        add_cache_tags(obj)
         self.object = obj
         return obj
 
+    def get_last_modified(self):
+        times = Article.objects.filter(pk=self.kwargs[self.pk_url_kwarg]).aggregate(
+            article=Max('last_mod_time'), comment=Max('comment__last_mod_time'))
+        return max(filter(None, times.values()), default=None)
+
     def get_context_data(self, **kwargs):
         articleid = int(self.kwargs[self.pk_url_kwarg])
         comment_form = CommentForm()
@@ -164,6 +292,19 @@ class ArticleDetailView(DetailView):
         return super(ArticleDetailView, self).get_context_data(**kwargs)
 
 
+def article_viewed(request, article_id, **kwargs):
+    """
+    Count a view of an article, also called for the pages served by PageCacheMiddleware.
+    Robots and the visitors seen in the last VISITORS_WINDOW are not counted
+    :return: True if the view was counted
+    """
+    visitor = get_visitor(request)
+    if visitor is None or not count_visit(int(article_id), visitor):
+        return False
+    Article.count_view(article_id)
+    return True
+
+
 class CategoryDetailView(ArticleListView):
     '''
     Category list
@@ -173,24 +314,31 @@ class CategoryDetailView(ArticleListView):
     def __init__(self):
         self.page = 'category_details'
 
+    def get_category(self):
+        category = get_category_index().get_by_slug(self.kwargs['category_name'])
+        if category is None:
+            raise Http404('Category not found')
+        return category
+
     def get_queryset_data(self):
-        slug = self.kwargs['category_name']
-        category = get_object_or_404(Category, slug=slug)
+        category = self.get_category()
 
         categoryname = category.name
         self.categoryname = categoryname
-        categorynames = list(map(lambda c: c.name, category.get_sub_categorys()))
-        article_list = Article.objects.filter(category__name__in=categorynames, status='p')
+        category_ids = get_category_index().get_descendant_ids(category.id)
+        article_list = Article.objects.filter(category_id__in=category_ids, status='p')
         return article_list
 
     def get_queryset_cache_key(self):
-        slug = self.kwargs['category_name']
-        category = get_object_or_404(Category, slug=slug)
+        category = self.get_category()
         categoryname = category.name
         self.categoryname = categoryname
         cache_key = 'category_list_{categoryname}_{page}'.format(categoryname=categoryname, page=self.page_number)
         return cache_key
 
+    def get_queryset_cache_tags(self):
+        return super(CategoryDetailView, self).get_queryset_cache_tags() + [Category]
+
     def get_context_data(self, **kwargs):
 
         categoryname = self.categoryname
@@ -255,6 +403,9 @@ class TagDetailView(ArticleListView):
         cache_key = 'tag_{tag_name}_{page}'.format(tag_name=tag_name, page=self.page_number)
         return cache_key
 
+    def get_queryset_cache_tags(self):
+        return super(TagDetailView, self).get_queryset_cache_tags() + [Tag]
+
     def get_context_data(self, **kwargs):
         # tag_name = self.kwargs['tag_name']
         tag_name = self.name
@@ -295,6 +446,7 @@ class LinkListView(ListView):
     template_name = 'blog/links_list.html'
 
     def get_queryset(self):
+        add_cache_tags(Links)
         return Links.objects.filter(is_enabled=True)
 
 
@@ -345,12 +497,18 @@ def fileupload(request):
 
 @login_required
 def refresh_memcache(request):
+    """
+    Flush cache namespaces, e.g. /refresh?namespace=sidebar&namespace=lists.
+    All of them are flushed when none is given
+    """
     try:
         if request.user.is_superuser:
-            from DjangoBlog.utils import cache
-            if cache and cache is not None:
-                cache.clear()
-                logger.info("cache has been cleared successfully")
+            namespaces = request.GET.getlist('namespace')
+            unknown = [n for n in namespaces if n not in CACHE_NAMESPACES]
+            if unknown:
+                return HttpResponseBadRequest('Unknown cache namespace: ' + ', '.join(unknown))
+            flush_cache_namespace(*namespaces)
+            logger.info("cache namespaces {} have been flushed successfully".format(namespaces or 'all'))
             return HttpResponseRedirect('/')
         else:
             return HttpResponseForbidden()
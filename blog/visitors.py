@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+import math
+import re
+import threading
+import time
+from hashlib import md5
+from django.conf import settings
+from DjangoBlog.utils import cache
+
+# unique visitors of an article, HyperLogLog registers merged by every process
+VISITORS_KEY = 'article_visitors_{id}'
+# visitors seen in one window, a Bloom filter per window
+VISITORS_SEEN_KEY = 'article_visitors_seen_{id}_{window}'
+# a view is counted once per visitor in one to two windows
+VISITORS_WINDOW = 60 * 30
+VISITORS_PUBLISH_INTERVAL = 10
+HLL_PRECISION = 10
+BOT_USER_AGENT_RE = re.compile(
+    r'bot|spider|crawl|slurp|archiver|fetch|monitor|preview|scan|curl|wget|python|java/|go-http|http.?client|headless',
+    re.IGNORECASE)
+
+_local_visitors = {}
+_local_lock = threading.Lock()
+_visitors_published_at = 0
+_publish_timer = None
+
+
+def _hash(value):
+    return md5(value.encode('utf-8')).digest()
+
+
+class HyperLogLog():
+    """Count of distinct values in 2 ** precision bytes, about 3% off for the default precision"""
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers else bytearray(1 << precision)
+
+    def add(self, value):
+        """
+        :return: True when a register changed
+        """
+        x = int.from_bytes(_hash(value)[:8], 'big')
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        """Union with another sketch, merging is idempotent so a sketch can be merged any number of times"""
+        if other:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __bool__(self):
+        return any(self.registers)
+
+    def __bytes__(self):
+        return bytes(self.registers)
+
+
+def bloom_shape(capacity=None, error_rate=None):
+    """
+    :return: bytes and hashes of a Bloom filter holding capacity values with a false positive rate of error_rate,
+    VISITORS_PER_WINDOW and VISITORS_FALSE_POSITIVE_RATE by default
+    """
+    capacity = capacity or settings.VISITORS_PER_WINDOW
+    error_rate = error_rate or settings.VISITORS_FALSE_POSITIVE_RATE
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    return (bits + 7) // 8, max(1, round(bits / capacity * math.log(2)))
+
+
+class BloomFilter():
+    """Set membership in size bytes, without false negatives"""
+
+    def __init__(self, bits=None, size=None, hashes=None):
+        default_size, default_hashes = bloom_shape()
+        size = size or default_size
+        # the filters saved with another size are dropped, their visitors are counted once more
+        self.bits = bytearray(bits) if bits and len(bits) == size else bytearray(size)
+        self.hashes = hashes or default_hashes
+
+    def _positions(self, value):
+        # the positions are derived from two hashes, h1 + i * h2
+        digest = _hash(value)
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        size = len(self.bits) * 8
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, value):
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+    def merge(self, other):
+        if other and len(other.bits) == len(self.bits):
+            self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+
+    def __bool__(self):
+        return any(self.bits)
+
+    def __bytes__(self):
+        return bytes(self.bits)
+
+
+class RotatingBloomFilter():
+    """
+    Bloom filters of the current and the previous window, the older ones are dropped,
+    so a filter never fills up and a value is remembered for one to two windows
+    """
+
+    def __init__(self, filters=None):
+        self.filters = filters or {}
+
+    def rotate(self, window):
+        self.filters = {w: f for w, f in self.filters.items() if w >= window - 1}
+
+    def add(self, value, window):
+        self.rotate(window)
+        self.filters.setdefault(window, BloomFilter()).add(value)
+
+    def __contains__(self, value):
+        return any(value in f for f in self.filters.values())
+
+
+class ArticleVisitors():
+    def __init__(self):
+        self.unique = HyperLogLog()
+        self.seen = RotatingBloomFilter()
+        self.dirty = False
+
+    def visit(self, visitor, window):
+        """
+        Every visitor is added to the HyperLogLog, a false positive of the Bloom filters drops a view only
+        :return: False for a visitor already seen in the last windows
+        """
+        if self.unique.add(visitor):
+            self.dirty = True
+        self.seen.rotate(window)
+        if visitor in self.seen:
+            return False
+        self.seen.add(visitor, window)
+        self.dirty = True
+        return True
+
+    def merge(self, shared, article_id, window):
+        """
+        :param shared: values of get_many for the keys of article_id
+        """
+        self.unique.merge(HyperLogLog(shared.get(VISITORS_KEY.format(id=article_id))))
+        for w in (window - 1, window):
+            bits = shared.get(VISITORS_SEEN_KEY.format(id=article_id, window=w))
+            if bits:
+                self.seen.filters.setdefault(w, BloomFilter()).merge(BloomFilter(bits))
+
+
+def _shared_keys(article_id, window):
+    return [VISITORS_KEY.format(id=article_id)] + \
+           [VISITORS_SEEN_KEY.format(id=article_id, window=w) for w in (window - 1, window)]
+
+
+def is_bot(user_agent):
+    return not user_agent or bool(BOT_USER_AGENT_RE.search(user_agent))
+
+
+def get_visitor(request):
+    """
+    :return: id of the visitor, None for robots
+    """
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    if is_bot(user_agent):
+        return None
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user:{pk}'.format(pk=user.pk)
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    ip = forwarded.split(',')[0].strip() if forwarded else request.META.get('REMOTE_ADDR', '')
+    return '{ip}:{user_agent}'.format(ip=ip, user_agent=user_agent)
+
+
+def count_visit(article_id, visitor):
+    """
+    Add a visitor to the sketches of the article, kept in this process and merged into the shared cache
+    by publish_visitors
+    :return: True for a visitor not seen in the last windows, their view counts
+    """
+    window = int(time.time() // VISITORS_WINDOW)
+    visitors = _local_visitors.get(article_id)
+    if visitors is None:
+        # a process starts from the shared sketches, so it knows the visitors counted by the others
+        visitors = ArticleVisitors()
+        visitors.merge(cache.get_many(_shared_keys(article_id, window)), article_id, window)
+    with _local_lock:
+        visitors = _local_visitors.setdefault(article_id, visitors)
+        new = visitors.visit(visitor, window)
+    publish_visitors()
+    _schedule_publish()
+    return new
+
+
+def _schedule_publish():
+    """
+    Publish the sketches left dirty after the last visit, a process that gets no more visits would keep them
+    """
+    global _publish_timer
+    with _local_lock:
+        if _publish_timer is not None or not any(v.dirty for v in _local_visitors.values()):
+            return
+        _publish_timer = threading.Timer(VISITORS_PUBLISH_INTERVAL, _publish_scheduled)
+        _publish_timer.daemon = True
+        _publish_timer.start()
+
+
+def _publish_scheduled():
+    global _publish_timer
+    with _local_lock:
+        _publish_timer = None
+    publish_visitors(force=True)
+
+
+def publish_visitors(force=False):
+    """
+    Merge the sketches of this process into the shared cache, at most once per VISITORS_PUBLISH_INTERVAL.
+    Two processes publishing at once may lose one update, it's published again on its next visit
+    """
+    from blog.models import mark_article_dirty
+    global _visitors_published_at
+    now = time.time()
+    if not force and now - _visitors_published_at < VISITORS_PUBLISH_INTERVAL:
+        return
+    _visitors_published_at = now
+    window = int(now // VISITORS_WINDOW)
+    with _local_lock:
+        for article_id in [i for i, v in _local_visitors.items() if not v.dirty]:
+            # idle articles are loaded again from the shared cache on their next visit
+            del _local_visitors[article_id]
+        dirty = list(_local_visitors.items())
+    for article_id, visitors in dirty:
+        keys = _shared_keys(article_id, window)
+        shared = cache.get_many(keys)
+        with _local_lock:
+            visitors.merge(shared, article_id, window)
+            visitors.seen.rotate(window)
+            visitors.dirty = False
+            values = {keys[0]: bytes(visitors.unique)}
+            for w, f in visitors.seen.filters.items():
+                values[VISITORS_SEEN_KEY.format(id=article_id, window=w)] = bytes(f)
+        cache.set_many({k: v for k, v in values.items() if k != keys[0]}, VISITORS_WINDOW * 2)
+        # the HyperLogLog counts the visitors since the last flush_visitors, not those of a window:
+        # it must not expire before the next flush merges it into the saved sketch
+        cache.set(keys[0], values[keys[0]], None)
+        mark_article_dirty(article_id)
+
+
+def forget_visitors(article_id):
+    """Drop the sketches of a deleted article, its id may be used again"""
+    with _local_lock:
+        _local_visitors.pop(article_id, None)
+    cache.delete_many(_shared_keys(article_id, int(time.time() // VISITORS_WINDOW)))
+
+
+def flush_visitors(ids=None, batch_size=500):
+    """
+    Persist the shared HyperLogLog of the articles visited since the last flush with the one saved before
+    and update unique_visitors
+    :param ids: articles to flush, those logged by mark_article_dirty by default
+    :return: number of articles updated
+    """
+    from blog.models import Article, VisitorSketch, pop_dirty_articles
+    if ids is None:
+        ids = pop_dirty_articles()
+    updated = 0
+    for start in range(0, len(ids), batch_size):
+        keys = {VISITORS_KEY.format(id=i): i for i in ids[start:start + batch_size]}
+        shared = cache.get_many(list(keys))
+        if not shared:
+            continue
+        # the saved sketch of each article, None for no sketch yet, the deleted articles are left out
+        saved = dict(Article.objects.filter(pk__in=[keys[k] for k in shared])
+                     .values_list('id', 'visitorsketch__registers'))
+        sketches = []
+        articles = []
+        values = {}
+        for key, registers in shared.items():
+            article_id = keys[key]
+            if article_id not in saved:
+                continue
+            unique = HyperLogLog(registers)
+            unique.merge(HyperLogLog(saved[article_id]))
+            if saved[article_id] is not None and bytes(saved[article_id]) == bytes(unique):
+                continue
+            sketches.append(VisitorSketch(article_id=article_id, registers=bytes(unique)))
+            articles.append(Article(id=article_id, unique_visitors=unique.count()))
+            # the visitors counted before the cache was emptied are kept too
+            values[key] = bytes(unique)
+        VisitorSketch.objects.bulk_update([s for s in sketches if saved[s.article_id] is not None], ['registers'])
+        VisitorSketch.objects.bulk_create([s for s in sketches if saved[s.article_id] is None])
+        Article.objects.bulk_update(articles, ['unique_visitors'])
+        cache.set_many(values, None)
+        updated += len(articles)
+    return updated
@@ -3,14 +3,19 @@ from django.contrib import admin
 from .models import Comment
 from django.urls import reverse
 from django.utils.html import format_html
+from django.utils.timezone import now
+from DjangoBlog.utils import cache_tag, invalidate_cache_tags
 
 
 def disable_commentstatus(modeladmin, request, queryset):
-    queryset.update(is_enabled=False)
+    queryset.update(is_enabled=False, last_mod_time=now())
+    # update() sends no post_save, so the cached pages are invalidated here
+    invalidate_cache_tags(Comment, *queryset, *[cache_tag('blog.article', c.article_id) for c in queryset])
 
 
 def enable_commentstatus(modeladmin, request, queryset):
-    queryset.update(is_enabled=True)
+    queryset.update(is_enabled=True, last_mod_time=now())
+    invalidate_cache_tags(Comment, *queryset, *[cache_tag('blog.article', c.article_id) for c in queryset])
 
 
 disable_commentstatus.short_description = 'Отключить комментарии'
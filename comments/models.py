@@ -1,12 +1,12 @@
 from django.db import models
 from django.conf import settings
-from blog.models import Article
+from blog.models import Article, MarkdownBodyModel, CacheListedModel
 from django.utils.timezone import now
 
 
 # Create your models here.
 
-class Comment(models.Model):
+class Comment(MarkdownBodyModel, CacheListedModel):
     body = models.TextField('Текст', max_length=300)
     created_time = models.DateTimeField('Время создания', default=now)
     last_mod_time = models.DateTimeField('Время редактирования', default=now)
@@ -15,6 +15,9 @@ class Comment(models.Model):
     parent_comment = models.ForeignKey('self', verbose_name="Предыдуший комментарий", blank=True, null=True, on_delete=models.CASCADE)
     is_enabled = models.BooleanField('Включен', default=True, blank=False, null=False)
 
+    # the sidebar shows the latest comments
+    cache_list_fields = ('body', 'is_enabled', 'article', 'author')
+
     class Meta:
         ordering = ['id']
         verbose_name = "Комментарий"
@@ -25,4 +28,8 @@ class Comment(models.Model):
         return self.body
 
     def save(self, *args, **kwargs):
+        if self.pk is not None:
+            self.last_mod_time = now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = list(kwargs['update_fields']) + ['last_mod_time']
         super().save(*args, **kwargs)
@@ -17,7 +17,7 @@ def parse_commenttree(commentlist, comment):
     datas = []
 
     def parse(c):
-        childs = commentlist.filter(parent_comment=c, is_enable=True)
+        childs = commentlist.filter(parent_comment=c, is_enabled=True)
         for child in childs:
             datas.append(child)
             parse(child)
@@ -485,7 +485,7 @@ class QQOauthManager(BaseOauthManager):
             return user
 
 
-@cache_decorator(expiration=100 * 60)
+@cache_decorator(expiration=100 * 60, depends_on=('oauth.oauthconfig',), namespace='oauth', key='oauth_apps')
 def get_oauth_apps():
     configs = OAuthConfig.objects.filter(is_enabled=True).all()
     if not configs:
@@ -31,9 +31,10 @@ tuling = TuLing()
 
 def convert_to_articlereply(articles, message):
     reply = ArticlesReply(message=message)
-    from blog.templatetags.blog_tags import custom_markdown, truncatechars_content
-    from DjangoBlog.utils import CommonMarkdown
-    from django.utils.safestring import mark_safe
+    from django.utils.html import strip_tags
+    from django.utils.text import Truncator
+    from DjangoBlog.utils import get_blog_setting
+    length = get_blog_setting().article_sub_length
     for post in articles:
         imgs = re.findall(r'(?:http\:|https\:)?\/\/.*\.(?:png|jpg)', post.body)
         imgurl = ''
@@ -41,7 +42,8 @@ def convert_to_articlereply(articles, message):
             imgurl = imgs[0]
         article = Article(
             title=post.title,
-            description=truncatechars_content(post.body),
+            # WeChat shows the description as plain text
+            description=Truncator(strip_tags(post.get_body_html()).strip()).chars(length),
             img=imgurl,
             url=post.get_full_url()
         )
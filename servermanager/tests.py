@@ -4,7 +4,7 @@ from .models import commands
 import datetime
 from accounts.models import BlogUser
 from blog.models import Category, Article
-from .robot import search, category, recents
+from .robot import search, category, recents, convert_to_articlereply
 from werobot.messages.messages import TextMessage
 from .robot import MessageHandler, CommandHandler
 from servermanager.Api.commonapi import TuLing
@@ -45,6 +45,9 @@ class ServerManagerTest(TestCase):
         s = TextMessage([])
         s.content = "nice"
         rsp = search(s, None)
+        # the description is plain text
+        reply = convert_to_articlereply([article], s)
+        self.assertEqual(reply._articles[0].description, 'nicecontentccc')
         rsp = category(None, None)
         self.assertIsNotNone(rsp)
         rsp = recents(None, None)